@@ -9,8 +9,13 @@ class DiRueLeiApp {
         this.pdfFiles = [];
         this.csvContent = null;
         this.csvFilename = null;
+        this.csvRosters = [];
+        this.rosterCsv = null;  // Class list the scanned labels are checked against
         this.allStudents = [];
         
+        this.zipChunks = [];
+        this.scanResults = new Map();  // File name -> list item of a streamed student
+        
         // Web Worker for all Python operations
         this.scanWorker = null;
         this.workerInitialized = false;
@@ -58,20 +63,40 @@ class DiRueLeiApp {
             case 'INITIALIZED':
                 this.workerInitialized = true;
                 console.log('Scan worker ready', 'success');
-                this.showStatus('Pakete vollständig geladen.', 'success'); 
-                while (document.getElementsByClassName("init-progress").length > 0) {
-                    document.getElementsByClassName("init-progress")[0].remove();
-                }
+                this.showStatus('Python-Umgebung geladen.', 'success'); 
+                this.clearInitProgress();
                 break;
                 
             case 'INIT_PROGRESS':
                 console.log(`Loading package ${data.current}/${data.total}: ${data.package}`);
                 this.showStatus(`Lade ${data.package} (Paket ${data.current}/${data.total})...`, 'init-progress');
                 break;
+
+            case 'FEATURE_LOADING':
+                console.log(`Loading ${data.feature}: ${data.packages.join(', ')}`);
+                this.showStatus(`Lade ${data.packages.join(', ')}...`, 'init-progress');
+                break;
+
+            case 'FEATURE_READY':
+                console.log(`Feature ${data.feature} ready`);
+                this.clearInitProgress();
+                break;
                 
             case 'SCAN_PROGRESS':
                 this.updateScanProgress(data.percentage);
                 break;
+
+            case 'SCAN_ZIP_CHUNK':
+                this.zipChunks.push(data.chunk);
+                break;
+
+            case 'SCAN_BATCH':
+                this.handleScanBatch(data);
+                break;
+
+            case 'SCAN_STUDENT':
+                this.addScanResult(data);
+                break;
                 
             case 'SCAN_LOG':
                 this.handleScanLog(data.message, data.level);
@@ -86,10 +111,24 @@ class DiRueLeiApp {
                 break;
                 
             case 'SCAN_COMPLETE':
+                this.setScanRunning(false);
                 this.handleScanComplete(data);
                 break;
+
+            case 'SCAN_METRICS':
+                // Timings of the scan for troubleshooting slow scans
+                console.table(data.metrics.stages);
+                this.downloadFile(JSON.stringify(data.metrics, null, 2), 'scan-metrics.json', 'application/json');
+                break;
+
+            case 'SCAN_CANCELLED':
+                this.setScanRunning(false);
+                this.zipChunks = [];
+                this.showStatus('Scan abgebrochen. Ein erneuter Scan derselben Dateien setzt an der letzten Zwischenspeicherung fort.', 'warning');
+                break;
                 
             case 'ERROR':
+                this.setScanRunning(false);
                 this.showStatus(data.message, 'error');
                 console.error('Worker error:', data.message);
                 break;
@@ -99,6 +138,17 @@ class DiRueLeiApp {
         }
     }
     
+    clearInitProgress() {
+        while (document.getElementsByClassName("init-progress").length > 0) {
+            document.getElementsByClassName("init-progress")[0].remove();
+        }
+    }
+    
+    loadWorkerFeature(feature) {
+        // The worker installs the packages of a feature on first use; starting early hides the wait
+        this.scanWorker?.postMessage({ type: 'LOAD_FEATURE', data: { feature: feature } });
+    }
+    
     updateScanProgress(percentage) {
         const progressBar = document.getElementById('scan-progress-bar');
         if (progressBar) {
@@ -110,21 +160,79 @@ class DiRueLeiApp {
     }
     
     handleScanLog(message, level) {
-        // Add log message to the output area
+        this.appendScanLogs([[message, level]]);
+    }
+    
+    handleScanBatch(data) {
+        // Log messages, the latest progress and page events the worker collected since its last batch
+        if (data.logs.length) {
+            this.appendScanLogs(data.logs);
+            for (const [message] of data.logs) {
+                console.log(message);
+            }
+        }
+        if (data.progress != null) {
+            this.updateScanProgress(data.progress);
+        }
+        for (const page of data.pages) {
+            console.debug(`Page ${page.pageNum + 1}: ${page.status}`);
+        }
+    }
+    
+    appendScanLogs(logs) {
+        // Add log messages to the output area; one insertion and one scroll per batch
         const outputDiv = document.getElementById('scan-output');
         if (outputDiv) {
-            const msgElement = document.createElement('div');
-            msgElement.classList.add('status-output');
-            msgElement.classList.add(level);
-            msgElement.innerText = message;
-            outputDiv.appendChild(msgElement);
+            const fragment = document.createDocumentFragment();
+            for (const [message, level] of logs) {
+                const msgElement = document.createElement('div');
+                msgElement.classList.add('status-output');
+                msgElement.classList.add(level);
+                msgElement.innerText = message;
+                fragment.appendChild(msgElement);
+            }
+            outputDiv.appendChild(fragment);
             outputDiv.scrollTop = outputDiv.scrollHeight;
         }
     }
     
+    addScanResult(data) {
+        // Finished students are listed while the scan is still running
+        const resultsDiv = document.getElementById('scan-results');
+        if (!resultsDiv) {
+            return;
+        }
+        resultsDiv.classList.remove('hidden');
+
+        // A student whose pages continue later in the stack is sent again with all pages so far
+        const fileName = data.fileName.split('/').pop();
+        const item = document.createElement('div');
+        item.classList.add('scan-result');
+        const label = document.createElement('span');
+        label.textContent = `${data.name}: ${data.numPages} Seite(n)`;
+        const openButton = document.createElement('button');
+        openButton.classList.add('btn', 'btn-small');
+        openButton.textContent = 'Öffnen';
+        openButton.addEventListener('click', () => {
+            this.openPdfInNewTab(data.pdf, fileName);
+        });
+        item.appendChild(label);
+        item.appendChild(openButton);
+        const previousItem = this.scanResults.get(data.fileName);
+        if (previousItem) {
+            previousItem.replaceWith(item);
+        } else {
+            resultsDiv.appendChild(item);
+        }
+        this.scanResults.set(data.fileName, item);
+    }
+    
     handleScanComplete(data) {
         try {
-            this.downloadFile(data.zipBytes, 'scan-results.zip', 'application/zip');
+            // The worker streams the ZIP in chunks; a Blob joins them without another copy
+            const zipBlob = new Blob(this.zipChunks, { type: 'application/zip' });
+            this.zipChunks = [];
+            this.downloadFile(zipBlob, 'scan-results.zip', 'application/zip');
             
             const summaryElement = document.getElementById("download-results-btn");
             if (summaryElement) {
@@ -139,6 +247,7 @@ class DiRueLeiApp {
             }
             
             this.showStatus('PDF Scan erfolgreich!', 'success');
+            this.showStatus('Vergessene Seiten einfach als weitere Datei hinzufügen und erneut einlesen: Dann werden nur die neuen Seiten gelesen.', 'info');
         } catch (error) {
             this.showStatus(`Fehler: ${error.message}`, 'error');
         }
@@ -146,7 +255,7 @@ class DiRueLeiApp {
     
     handleQRComplete(data) {
         try {
-            this.downloadFile(data.pdfBytes, data.filename, 'application/pdf');
+            this.downloadFile(data.pdfBytes, data.filename, data.mimeType || 'application/pdf');
             this.showStatus('QR-Codes erfolgreich erzeugt!', 'success');
         } catch (error) {
             this.showStatus(`Fehler beim Verarbeiten der QR-Codes: ${error.message}`, 'error');
@@ -159,8 +268,10 @@ class DiRueLeiApp {
             {'id': 'csv-file', 'func': this.handleCsvFileUpload, 'event': 'change'},
             {'id': 'generate-qr-btn', 'func': this.generateQRPdf, 'event': 'click'},
             {'id': 'pdf-files', 'func': this.handlePdfFilesUpload, 'event': 'change'},
+            {'id': 'roster-file', 'func': this.handleRosterFileUpload, 'event': 'change'},
             {'id': 'clear-pdf-files-btn', 'func': this.clearPdfFiles, 'event': 'click'},
             {'id': 'process-pdf-btn', 'func': this.startPdfScan, 'event': 'click'},
+            {'id': 'cancel-scan-btn', 'func': this.cancelPdfScan, 'event': 'click'},
             {'id': 'checkbox-use-offset', 'func': this.toggleOffset, 'event': 'change'},
             {'id': 'checkbox-select-students', 'func': this.toggleSelectStudents, 'event': 'change'},
             {'id': 'select-all', 'func': this.toggleSelectAll, 'event': 'change'}
@@ -260,7 +371,7 @@ class DiRueLeiApp {
         
         if (primaryText && secondaryText) {
             const isCsv = dropzone.id === 'csv-dropzone';
-            primaryText.textContent = `Bewegen Sie ${isCsv ? 'CSV-Datei' : 'PDF-Datei(en)'} in dieses Feld (Drag&Drop)`;
+            primaryText.textContent = `Bewegen Sie ${isCsv ? 'CSV-Datei(en)' : 'PDF-Datei(en)'} in dieses Feld (Drag&Drop)`;
             secondaryText.textContent = 'oder klicken Sie hier zum Durchsuchen';
         }
     }
@@ -318,19 +429,34 @@ class DiRueLeiApp {
     }
     
     async handleCsvFileUpload(event) {
-        const file = event.target.files[0];
-        if (!file) return;
+        const files = Array.from(event.target.files);
+        if (!files.length) return;
         
         try {
-            const csvData = await this.readFileAsText(file);
-            this.csvContent = csvData;
-            this.csvFilename = file.name;
-            this.allStudents = this.parseCSV(csvData);
+            // Several class lists are generated in one go, one PDF per class
+            this.csvRosters = [];
+            for (const file of files) {
+                this.csvRosters.push({ name: file.name, content: await this.readFileAsText(file) });
+            }
+            this.csvContent = this.csvRosters[0].content;
+            this.csvFilename = this.csvRosters[0].name;
+            this.allStudents = this.parseCSV(this.csvContent);
             
             document.getElementById('generate-qr-btn').disabled = false;
             document.getElementById('qr-settings').classList.remove('hidden');
             
-            this.showStatus(`Daten für ${this.allStudents.length} Schüler-/innen eingelesen.`, 'success');
+            // Selecting single students only makes sense for one class
+            const selectStudents = document.getElementById('checkbox-select-students');
+            selectStudents.closest('.setting-group').classList.toggle('hidden', files.length > 1);
+            if (files.length > 1) {
+                selectStudents.checked = false;
+                this.toggleSelectStudents();
+                const total = this.csvRosters.reduce((sum, roster) => sum + this.parseCSV(roster.content).length, 0);
+                this.showStatus(`${files.length} Klassenlisten mit ${total} Schüler-/innen eingelesen.`, 'success');
+            } else {
+                this.showStatus(`Daten für ${this.allStudents.length} Schüler-/innen eingelesen.`, 'success');
+            }
+            this.loadWorkerFeature('qr');
             this.populateStudentCheckboxes(this.allStudents);
             
         } catch (error) {
@@ -429,6 +555,19 @@ class DiRueLeiApp {
             const offsetRow = parseInt(document.getElementById('offset-row').value) || 1;
             const offsetCol = parseInt(document.getElementById('offset-col').value) || 1;
             
+            if (this.csvRosters.length > 1) {
+                this.scanWorker.postMessage({
+                    type: 'GENERATE_QR_BATCH',
+                    data: {
+                        rosters: this.csvRosters,
+                        copies: copies,
+                        offsetRow: offsetRow,
+                        offsetCol: offsetCol
+                    }
+                });
+                return;
+            }
+            
             // Send QR generation request to worker
             this.scanWorker.postMessage({
                 type: 'GENERATE_QR',
@@ -471,6 +610,8 @@ class DiRueLeiApp {
                 }
             }
             
+            this.loadWorkerFeature('scan');
+            
             // Update the display
             this.updatePdfFileList();
             document.getElementById('scan-settings')?.classList.remove('hidden');
@@ -480,6 +621,22 @@ class DiRueLeiApp {
         }
     }
     
+    async handleRosterFileUpload(event) {
+        const file = event.target.files[0];
+        if (!file) {
+            this.rosterCsv = null;
+            return;
+        }
+        
+        try {
+            this.rosterCsv = await this.readFileAsText(file);
+            this.showStatus(`Klassenliste mit ${this.parseCSV(this.rosterCsv).length} Schüler-/innen für den Abgleich eingelesen.`, 'success');
+        } catch (error) {
+            this.rosterCsv = null;
+            this.showStatus(`Fehler bei Lesen der CSV-Datei: ${error.message}`, 'error');
+        }
+    }
+    
     updatePdfFileList() {
         const dropzone = document.getElementById('pdf-dropzone');
         if (dropzone && this.pdfFiles.length > 0) {
@@ -503,6 +660,7 @@ class DiRueLeiApp {
     
     clearPdfFiles() {
         this.pdfFiles = [];
+        this.scanWorker?.postMessage({ type: 'SCAN_SESSION_RESET' });
         const dropzone = document.getElementById('pdf-dropzone');
         const fileInput = document.getElementById('pdf-files');
         
@@ -554,6 +712,15 @@ class DiRueLeiApp {
                 progressBar.setAttribute('aria-valuenow', 0);
             }
             
+            this.zipChunks = [];
+            this.scanResults.clear();
+            
+            const resultsDiv = document.getElementById('scan-results');
+            if (resultsDiv) {
+                resultsDiv.innerHTML = '';
+                resultsDiv.classList.add('hidden');
+            }
+            
             const outputDiv = document.getElementById('scan-output');
             if (outputDiv) {
                 outputDiv.innerHTML = '';
@@ -563,7 +730,15 @@ class DiRueLeiApp {
             const scanOptions = {
                 twoPageScan: document.getElementById('two-page-scan')?.checked || false,
                 splitA3: document.getElementById('split-a3')?.checked || false,
-                quickAndDirty: document.getElementById('quick-and-dirty')?.checked || false
+                detectGutter: document.getElementById('detect-gutter')?.checked || false,
+                rosterCsv: this.rosterCsv,
+                quickAndDirty: document.getElementById('quick-and-dirty')?.checked || false,
+                fullSummary: document.getElementById('full-summary')?.checked || false,
+                decodeWorkers: document.getElementById('parallel-decode')?.checked
+                    ? Math.max(2, Math.min(4, (navigator.hardwareConcurrency || 2) - 1))
+                    : 1,
+                persistCache: document.getElementById('persist-cache')?.checked || false,
+                profiling: document.getElementById('profiling')?.checked || false
             };
             
             const pdfFilesForWorker = this.pdfFiles.map(file => ({
@@ -571,6 +746,7 @@ class DiRueLeiApp {
                 data: new Uint8Array(file.data) // Create a copy
             }));
             
+            this.setScanRunning(true);
             this.scanWorker.postMessage({
                 type: 'SCAN_START',
                 data: {
@@ -585,6 +761,20 @@ class DiRueLeiApp {
         }
     }
     
+    cancelPdfScan() {
+        if (this.scanWorker) {
+            this.scanWorker.postMessage({ type: 'SCAN_CANCEL' });
+        }
+    }
+    
+    setScanRunning(running) {
+        document.getElementById('cancel-scan-btn')?.classList.toggle('hidden', !running);
+        const processButton = document.getElementById('process-pdf-btn');
+        if (processButton) {
+            processButton.disabled = running;
+        }
+    }
+    
     // Utility methods
     readFileAsText(file) {
         return new Promise((resolve, reject) => {
@@ -0,0 +1,238 @@
+# Scan pipeline benchmark with synthetic exam batches.
+#
+# Label sheets come from QRGenerator.generate_qr_pdf_bytes, the labels are placed on exam pages
+# (A4, A3 spreads, blank backsides), distorted (rotation, blur, noise, JPEG) and rasterized into
+# image-only PDFs like a copier would produce them. ExamReader then runs natively on every batch.
+# The batches are generated from a fixed seed, so runs are comparable across changes.
+#
+#   python benchmarks/scan_benchmark.py                      # default matrix
+#   python benchmarks/scan_benchmark.py --quick              # small matrix for a quick check
+#   python benchmarks/scan_benchmark.py --dpi 200 --workers 4 --json results.json
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+import cv2
+import fitz
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python_modules"))
+from qr_generator import PAGE_SPECS, QRGenerator
+from qr_reader import ExamReader
+
+A4_SIZE = (595, 842)
+A3_SIZE = (1191, 842)       # landscape spread, as PdfManager.detect_page_size expects it
+CM = 72 / 2.54
+
+# Label cells as laid out by QRGenerator.generate_qr_pdf_bytes (in points, top left origin)
+LABEL_COLS = PAGE_SPECS["num_cols"]
+LABEL_ROWS = PAGE_SPECS["num_rows"]
+LABEL_CELL = PAGE_SPECS["col_width"]
+LABEL_STEP = PAGE_SPECS["col_width"] + PAGE_SPECS["col_sep"]
+LABEL_ORIGIN = (PAGE_SPECS["margin-left"], PAGE_SPECS["margin-top"])
+
+ANGLES = [-15, -10, -5, 0, 5, 10, 15]
+NOISE_LEVELS = [0, 12]          # standard deviation of the gaussian noise (gray levels)
+BLUR_LEVELS = [0, 1.5]          # sigma of the gaussian blur (pixels at 200 dpi)
+JPEG_QUALITIES = [90, 40]
+DPIS = [150, 200, 300]
+
+
+def make_students(count) :
+    csv_content = "ID,Name\n" + "\n".join(f"Teilnehmer/in{5000+i},Vorname{i} Nachname{i:03d}" for i in range(count))
+    generator = QRGenerator(csv_content, "Benchmark_7a_.csv")
+    return (generator.get_students(), fitz.open(stream=generator.generate_qr_pdf_bytes(), filetype="pdf"))
+
+
+def label_clip(index) :
+    page_index, position = divmod(index, LABEL_COLS * LABEL_ROWS)
+    (row, col) = divmod(position, LABEL_COLS)
+    x0 = LABEL_ORIGIN[0] + col * LABEL_STEP
+    y0 = LABEL_ORIGIN[1] + row * LABEL_STEP
+    return (page_index, fitz.Rect(x0, y0, x0 + LABEL_CELL, y0 + LABEL_CELL))
+
+
+def compose_page(label_doc, label_index, size, label_position) :
+    # Vector exam page: answer lines and, unless label_index is None, a label cut from the sheet
+    doc = fitz.open()
+    (width, height) = size
+    page = doc.new_page(width=width, height=height)
+    for y in np.arange(height * 0.3, height * 0.92, 0.9 * CM):
+        page.draw_line((width * 0.08, y), (width * 0.92, y), color=(0.4, 0.4, 0.4), width=0.8)
+    if label_index is not None:
+        # 3 cm from the edges, so the label stays on the page when it is rotated by 15 degrees
+        (sheet_page, clip) = label_clip(label_index)
+        x0 = width - LABEL_CELL - 3 * CM if label_position == "right" else 3 * CM
+        page.show_pdf_page(fitz.Rect(x0, 3 * CM, x0 + LABEL_CELL, 3 * CM + LABEL_CELL), label_doc, sheet_page, clip=clip)
+    return doc
+
+
+def scan_page(doc, dpi, variation, rng) :
+    # Rasterize like a copier and apply the distortions; returns the JPEG of the scanned page
+    pix = doc[0].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    img = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.stride)[:, :pix.width].copy()
+    (h, w) = img.shape
+    if variation["angle"]:
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), variation["angle"], 1)
+        img = cv2.warpAffine(img, matrix, (w, h), flags=cv2.INTER_LINEAR, borderValue=255)
+    if variation["blur"]:
+        img = cv2.GaussianBlur(img, (0, 0), variation["blur"] * dpi / 200)
+    if variation["noise"]:
+        img = np.clip(img + rng.normal(0, variation["noise"], img.shape), 0, 255).astype(np.uint8)
+    (_, jpg) = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, variation["jpeg"]])
+    return jpg.tobytes()
+
+
+def build_batch(label_doc, students, dpi, variations, rng, a3_sheets=0) :
+    # Returns the image-only PDF and the expected result of every page. Every variation gets its own
+    # student and a blank backside; A3 sheets follow as booklet spreads (label page, blank inner page).
+    out = fitz.open()
+    expected = []
+
+    def add(size, label_index, label_position, variation, kind) :
+        doc = compose_page(label_doc, label_index, size, label_position)
+        jpg = scan_page(doc, dpi, variation, rng)
+        doc.close()
+        page = out.new_page(width=size[0], height=size[1])
+        page.insert_image(page.rect, stream=jpg)
+        student = students[label_index] if label_index is not None else None
+        expected.append({"kind": kind, "variation": variation,
+                         "value": f"{student['name']}_{student['id']}" if student else None})
+
+    for (i, variation) in enumerate(variations):
+        add(A4_SIZE, i, "right" if i % 2 == 0 else "left", variation, "label")
+        add(A4_SIZE, None, None, variation, "blank")
+    plain = {"angle": 0, "noise": 0, "blur": 0, "jpeg": 90}
+    for i in range(len(variations), len(variations) + a3_sheets):
+        add(A3_SIZE, i, "right", plain, "a3_label")
+        add(A3_SIZE, None, None, plain, "a3_blank")
+
+    data = out.tobytes(garbage=3, deflate=True)
+    out.close()
+    return (data, expected)
+
+
+async def run_reader(pdf_data, scan_options) :
+    # Runs the reader like the worker does and attributes the time between events to the stages
+    reader = ExamReader([{"name": "benchmark.pdf", "data": pdf_data}], scan_options)
+    reader.log_callback = lambda msg, type="info": None
+    stages = defaultdict(float)
+    pages = {}
+    student_pages = {}
+    tracemalloc.start()
+    start = last = time.perf_counter()
+    async for event in reader.process_events():
+        now = time.perf_counter()
+        if event["type"] == "page":
+            stages["decode"] += now - last
+            pages[event["page_num"]] = event
+        else:
+            stages["assemble"] += now - last
+            student_pages[event["student"]] = event["num_pages"]
+        last = now
+    stages["finish"] = time.perf_counter() - last
+    stages["total"] = time.perf_counter() - start
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {
+        "stages": dict(stages),
+        "pages": pages,
+        "student_pages": student_pages,
+        "peak_traced_mb": peak / 2**20,
+        "page_totals": reader.get_metrics()["page_totals"],
+        "zip_bytes": len(reader.get_zip_bytes()),
+        "summary_bytes": len(reader.get_summary_bytes()),
+    }
+    reader.close()
+    return result
+
+
+def evaluate(expected, pages, student_pages) :
+    # Success rates of the label pages per distortion, of the inferred backsides, and of the A3 sheets
+    # split into their 4 A4 pages
+    groups = defaultdict(lambda: [0, 0])
+    for (page_num, truth) in enumerate(expected):
+        event = pages.get(page_num, {})
+        if truth["kind"] in ("label", "a3_label"):
+            ok = event.get("status") == "read" and event.get("value") == truth["value"]
+            checks = [(("kind", truth["kind"]), ok)]
+            if truth["kind"] == "label":
+                checks += [((name, truth["variation"][name]), ok) for name in ("angle", "noise", "blur", "jpeg")]
+            else:
+                checks.append((("kind", "a3_split"), student_pages.get(truth["value"]) == 4))
+        else:
+            checks = [(("kind", truth["kind"]), event.get("status") == "from_previous")]
+        for (key, ok) in checks:
+            groups[key][0] += ok
+            groups[key][1] += 1
+    return {f"{name}={value}": {"ok": ok, "total": total, "rate": ok / total}
+            for ((name, value), (ok, total)) in sorted(groups.items())}
+
+
+def print_report(dpi, num_pages, run, rates) :
+    stages = run["stages"]
+    print(f"\n=== {dpi} dpi, {num_pages} pages ===")
+    print(f"  total     {stages['total']:8.2f} s   {num_pages / stages['total']:7.2f} pages/s")
+    for stage in ("decode", "assemble", "finish"):
+        print(f"  {stage:9} {stages.get(stage, 0):8.2f} s   {num_pages / max(stages.get(stage, 0), 1e-9):7.2f} pages/s")
+    totals = run["page_totals"]
+    print(f"  per page: render {totals['render'] / num_pages * 1000:.0f} ms, locate {totals['locate'] / num_pages * 1000:.0f} ms, "
+          f"detector {totals['decode'] / num_pages * 1000:.0f} ms, {totals['attempts'] / num_pages:.1f} attempts")
+    print(f"  peak traced memory {run['peak_traced_mb']:.1f} MB, ZIP {run['zip_bytes'] / 2**20:.1f} MB, summary {run['summary_bytes'] / 2**20:.1f} MB")
+    print("  decode success:")
+    for (key, rate) in rates.items():
+        print(f"    {key:14} {rate['ok']:4}/{rate['total']:<4} {rate['rate']:6.1%}")
+
+
+def main() :
+    parser = argparse.ArgumentParser(description="Benchmark the scan pipeline on synthetic exam batches.")
+    parser.add_argument("--dpi", type=int, nargs="+", default=DPIS)
+    parser.add_argument("--quick", action="store_true", help="fewer angles and distortions")
+    parser.add_argument("--a3-sheets", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=1, help="decode_workers of the reader")
+    parser.add_argument("--quick-and-dirty", action="store_true")
+    parser.add_argument("--summary-mode", choices=["thumbnails", "full"], default="thumbnails")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    angles = [-15, 0, 15] if args.quick else ANGLES
+    noise_levels = NOISE_LEVELS[:1] if args.quick else NOISE_LEVELS
+    variations = [{"angle": angle, "noise": noise, "blur": blur, "jpeg": jpeg}
+                  for (angle, noise, blur, jpeg) in itertools.product(angles, noise_levels, BLUR_LEVELS, JPEG_QUALITIES)]
+    (students, label_doc) = make_students(len(variations) + args.a3_sheets)
+    scan_options = {"two_page_scan": True, "split_a3": True, "quick_and_dirty": args.quick_and_dirty,
+                    "decode_workers": args.workers, "summary_mode": args.summary_mode, "profiling": True}
+
+    results = []
+    for dpi in args.dpi:
+        rng = np.random.default_rng(args.seed)
+        build_start = time.perf_counter()
+        (pdf_data, expected) = build_batch(label_doc, students, dpi, variations, rng, args.a3_sheets)
+        print(f"Built {len(expected)} pages at {dpi} dpi ({len(pdf_data) / 2**20:.1f} MB) in {time.perf_counter() - build_start:.1f} s")
+        run = asyncio.run(run_reader(pdf_data, scan_options))
+        rates = evaluate(expected, run["pages"], run["student_pages"])
+        print_report(dpi, len(expected), run, rates)
+        results.append({"dpi": dpi, "pages": len(expected), "input_bytes": len(pdf_data), "stages": run["stages"],
+                        "page_totals": run["page_totals"], "peak_traced_mb": run["peak_traced_mb"], "zip_bytes": run["zip_bytes"],
+                        "summary_bytes": run["summary_bytes"], "success": rates})
+
+    # ru_maxrss is in kB on Linux and covers MuPDF and OpenCV allocations that tracemalloc misses
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"\nPeak RSS of the benchmark process: {max_rss_mb:.0f} MB")
+    label_doc.close()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"options": vars(args), "max_rss_mb": max_rss_mb, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
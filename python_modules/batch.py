@@ -0,0 +1,185 @@
+# Native batch mode: runs ExamReader and QRGenerator with plain CPython, without the browser.
+#
+#   python python_modules/batch.py scan SCANS_DIR OUTPUT_DIR [--two-page-scan] [--split-a3] [--workers 8]
+#   python python_modules/batch.py scan SCANS_DIR OUTPUT_DIR --per-file --workers 8
+#   python python_modules/batch.py qr Teilnehmer_7a_.csv OUTPUT_DIR --copies 2
+#   python python_modules/batch.py qr rosters/*.csv OUTPUT_DIR --zip
+#
+# A scan writes scan-results.zip and summary.pdf to its output directory. By default all PDFs of the
+# directory form one scan and its pages are decoded by a pool of processes. With --per-file every PDF
+# is a scan of its own, written to OUTPUT_DIR/<file name>/, and the pool runs several files at once.
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from qr_reader import ExamReader
+from qr_generator import generate_qr_batch
+
+
+def scan_options_from_args(args) :
+    return {
+        "two_page_scan": args.two_page_scan,
+        "split_a3": args.split_a3,
+        "detect_gutter": args.detect_gutter,
+        "quick_and_dirty": args.quick_and_dirty,
+        "summary_mode": "full" if args.full_summary else "thumbnails",
+        "render_dpi": args.dpi,
+        "profiling": args.profile,
+        "log_debug": args.verbose,
+    }
+
+
+def run_scan(pdf_paths, output_dir, scan_options, label="", extract=False, resume=False, cache=False) :
+    # One scan of the given files; the ZIP is streamed to disk while students are finished
+    os.makedirs(output_dir, exist_ok=True)
+    scan_options = dict(scan_options)
+    if resume:
+        scan_options["checkpoint_path"] = os.path.join(output_dir, "scan-checkpoint.json")
+    if cache:
+        scan_options["decode_cache_path"] = os.path.join(output_dir, "decode-cache.json")
+
+    files = []
+    for path in pdf_paths:
+        with open(path, "rb") as f:
+            files.append({"name": os.path.basename(path), "data": f.read()})
+    reader = ExamReader(files, scan_options)
+    prefix = f"[{label}] " if label else ""
+    reader.log_callback = lambda msg, type="info": print(f"{prefix}{type}: {msg}", file=sys.stderr)
+
+    def write_student(event) :
+        if extract and event["type"] == "student":
+            path = os.path.join(output_dir, event["file_name"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(event["pdf"])
+    reader.event_callback = write_student
+
+    start = time.perf_counter()
+    zip_path = os.path.join(output_dir, "scan-results.zip")
+    with open(zip_path + ".part", "wb") as zip_file:
+        reader.zip_chunk_callback = zip_file.write
+        success = asyncio.run(reader.process())
+    if success:
+        os.replace(zip_path + ".part", zip_path)
+        with open(os.path.join(output_dir, "summary.pdf"), "wb") as f:
+            f.write(reader.get_summary_bytes())
+    else:
+        os.remove(zip_path + ".part")
+
+    result = {
+        "label": label,
+        "success": success,
+        "pages": reader.page_count(),
+        "students": len(reader.student_page_map) if success else 0,
+        "missing_pages": len(reader.missing_pages),
+        "students_without_pages": len(reader.students_without_pages),
+        "seconds": time.perf_counter() - start,
+    }
+    reader.close()
+    return result
+
+
+def _run_scan_job(job) :
+    # Entry point of the process pool in --per-file mode
+    return run_scan(**job)
+
+
+def pdf_files_in(directory) :
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith(".pdf"))
+
+
+def scan_command(args) :
+    pdf_paths = pdf_files_in(args.input_dir)
+    if not pdf_paths:
+        print(f"No PDF files in {args.input_dir}", file=sys.stderr)
+        return 1
+    scan_options = scan_options_from_args(args)
+    if args.roster:
+        with open(args.roster, encoding="utf-8-sig") as f:
+            scan_options["roster"] = f.read()
+
+    if not args.per_file:
+        # One scan; its pages are spread over the pool
+        scan_options["decode_workers"] = args.workers
+        results = [run_scan(pdf_paths, args.output_dir, scan_options, extract=args.extract,
+                            resume=args.resume, cache=args.cache)]
+    else:
+        # One scan per file; every scan decodes sequentially, the pool runs the files in parallel
+        jobs = [{"pdf_paths": [path], "output_dir": os.path.join(args.output_dir, os.path.splitext(os.path.basename(path))[0]),
+                 "scan_options": scan_options, "label": os.path.basename(path), "extract": args.extract,
+                 "resume": args.resume, "cache": args.cache} for path in pdf_paths]
+        results = []
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(_run_scan_job, job) for job in jobs]
+            for future in as_completed(futures):
+                results.append(future.result())
+
+    for result in sorted(results, key=lambda r: r["label"]):
+        status = "ok" if result["success"] else "FAILED"
+        print(f"{result['label'] or args.input_dir}: {status}, {result['pages']} pages, {result['students']} students, "
+              f"{result['missing_pages']} unassigned pages, {result['students_without_pages']} students without pages, "
+              f"{result['seconds']:.1f} s")
+    return 0 if all(result["success"] for result in results) else 1
+
+
+def qr_command(args) :
+    rosters = []
+    for path in args.csv_files:
+        with open(path, encoding="utf-8-sig") as f:
+            rosters.append({"name": os.path.basename(path), "content": f.read()})
+    result = generate_qr_batch(rosters, args.copies, args.offset_row, args.offset_col, vector=not args.raster,
+                               as_zip=args.zip, workers=args.workers)
+    files = {"QR-Codes.zip": result} if args.zip else result
+    os.makedirs(args.output_dir, exist_ok=True)
+    for (name, data) in files.items():
+        path = os.path.join(args.output_dir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        print(f"written {path}")
+    return 0
+
+
+def main(argv=None) :
+    parser = argparse.ArgumentParser(description="Scan exams or generate QR labels without the browser.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="split scanned exams by the QR labels")
+    scan.add_argument("input_dir", help="directory with the scanned PDFs")
+    scan.add_argument("output_dir")
+    scan.add_argument("--two-page-scan", action="store_true", help="pages without a label belong to the previous page")
+    scan.add_argument("--split-a3", action="store_true", help="split A3 booklets into A4 pages")
+    scan.add_argument("--detect-gutter", action="store_true", help="split A3 spreads at the gap between the halves")
+    scan.add_argument("--quick-and-dirty", action="store_true")
+    scan.add_argument("--dpi", type=int, default=216, help="render resolution for pages that are not plain scans")
+    scan.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    scan.add_argument("--per-file", action="store_true", help="treat every PDF as a scan of its own")
+    scan.add_argument("--extract", action="store_true", help="also write the student PDFs next to the ZIP")
+    scan.add_argument("--resume", action="store_true", help="keep a checkpoint and continue an interrupted scan")
+    scan.add_argument("--cache", action="store_true", help="keep decoded pages for the next run")
+    scan.add_argument("--full-summary", action="store_true", help="copy all pages into summary.pdf instead of thumbnails")
+    scan.add_argument("--roster", help="class list CSV; labels of other students are discarded")
+    scan.add_argument("--profile", action="store_true", help="log per-stage timings")
+    scan.add_argument("--verbose", action="store_true", help="include debug messages")
+    scan.set_defaults(func=scan_command)
+
+    qr = commands.add_parser("qr", help="generate the QR label sheets for one or more class lists")
+    qr.add_argument("csv_files", nargs="+", help="participant lists (ID, name) as exported from the LMS")
+    qr.add_argument("output_dir")
+    qr.add_argument("--copies", type=int, default=1)
+    qr.add_argument("--offset-row", type=int, default=1)
+    qr.add_argument("--offset-col", type=int, default=1)
+    qr.add_argument("--raster", action="store_true", help="embed the codes as images instead of vector graphics")
+    qr.add_argument("--zip", action="store_true", help="write all sheets into QR-Codes.zip")
+    qr.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    qr.set_defaults(func=qr_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,28 +1,32 @@
-import csv
 import io
+import os
 import re
-from PIL import Image
+import sys
+import zipfile
 import qrcode
 from reportlab.pdfgen import canvas        
 from reportlab.lib.pagesizes import A4        
 from reportlab.lib.units import cm   
-from reportlab.lib.utils import ImageReader
+from roster import parse_roster, qr_payload
+
+# Label layout of the sheets (points, top-down); the scan benchmark cuts labels at the same positions
+PAGE_SPECS = {
+    "page_height": A4[1],
+    "margin-top": 1 * cm,
+    "margin-left": 0.7 * cm,
+    "col_width": 3.5 * cm,
+    "row_height": 3.5 * cm,
+    "row_sep": 0.5 * cm,
+    "col_sep": 0.5 * cm,
+    "num_cols": 5, 
+    "num_rows": 7,
+    "qr_per_page": 35,
+    "qr_size": 2 * cm
+}
 
 class QRGenerator:
     def __init__(self, csv_content, file_name):
-        students = []
-        csv_reader = csv.DictReader(io.StringIO(csv_content), delimiter=',')
-        string_id = csv_reader.fieldnames[0]
-        string_name = csv_reader.fieldnames[1]
-
-        for row in csv_reader:
-            row[string_id] = row[string_id].replace("Teilnehmer/in", "")
-            students.append({
-                'id': row[string_id],
-                'name': row[string_name]
-            })
-
-        self.students = self.sort_students(students)
+        self.students = self.sort_students(parse_roster(csv_content))
         self.class_name = self._guess_class_from_filename(file_name)
     
     def get_students(self):
@@ -43,6 +47,7 @@ class QRGenerator:
             return "_" + class_string.group().replace("_", "")
 
     def create_qr_image(self, id, name):
+        from PIL import Image
         qr = qrcode.QRCode(version=1, box_size=10, border=2)
         qr.add_data(name + "_" + id)
         qr.make(fit=True)
@@ -50,8 +55,46 @@ class QRGenerator:
         qr_size_px = int((3 / 2.54) * 300) 
         img_qr = img_qr.resize((qr_size_px, qr_size_px), Image.LANCZOS)
         return img_qr
+
+    def create_qr_matrix(self, id, name):
+        qr = qrcode.QRCode(version=1, border=2)
+        qr.add_data(name + "_" + id)
+        qr.make(fit=True)
+        return qr.get_matrix()
+
+    def _draw_qr_form(self, c, form_name, matrix, size):
+        # The modules of a code as one filled path, dark runs of a row merged into a single rectangle.
+        # The form is stored once in the PDF and referenced by every copy of the label.
+        module = size / len(matrix)
+        c.beginForm(form_name, 0, 0, size, size)
+        # Forms repeat the top-down preamble of the page (A4 canvas); undo it, the page already flips the form on use
+        c.transform(1, 0, 0, -1, 0, A4[1])
+        path = c.beginPath()
+        for (row, modules) in enumerate(matrix):
+            col = 0
+            while col < len(modules):
+                if not modules[col]:
+                    col += 1
+                    continue
+                run_start = col
+                while col < len(modules) and modules[col]:
+                    col += 1
+                path.rect(run_start * module, row * module, (col - run_start) * module, module)
+        c.drawPath(path, stroke=0, fill=1)
+        c.endForm()
+
+    def _draw_qr_image(self, c, student, x, y, size):
+        from reportlab.lib.utils import ImageReader
+        qr_img = self.create_qr_image(student["id"], student["name"])
+        img_buffer = io.BytesIO()
+        qr_img.save(img_buffer, format="PNG")
+        img_buffer.seek(0)
+        c.drawImage(ImageReader(img_buffer), x, y, size, size)
+        img_buffer.close()
     
-    def generate_qr_pdf_bytes(self, copies=1, offset_row=1, offset_col=1):
+    def generate_qr_pdf_bytes(self, copies=1, offset_row=1, offset_col=1, vector=True):
+        """Label sheet as PDF bytes. The codes are drawn as vector forms, one per distinct code;
+        vector=False embeds a raster image for every label like earlier versions did."""
         try:
             python_students = self.students
             
@@ -59,43 +102,25 @@ class QRGenerator:
             if not python_students:
                 raise ValueError("No students data available for PDF generation")
             
-            _, page_height = A4
             buffer = io.BytesIO()
             c = canvas.Canvas(buffer, pagesize=A4, bottomup=0)
-
-            page_specs = {
-                "page_height": page_height,
-                "margin-top": 1 * cm,
-                "margin-left": 0.7 * cm,
-                "col_width": 3.5 * cm,
-                "row_height": 3.5 * cm,
-                "row_sep": 0.5 * cm,
-                "col_sep": 0.5 * cm,
-                "num_cols": 5, 
-                "num_rows": 7,
-                "qr_size": 2 * cm
-            }
+            page_specs = PAGE_SPECS
 
             offset = (offset_row - 1) * page_specs['num_cols'] + offset_col - 1
             
             if copies != 1:
                 python_students = self._repeat_array(python_students, copies)
 
-            page_specs["qr_per_page"] = page_specs["num_rows"] * page_specs["num_cols"]
             x_start = page_specs["margin-left"] + (page_specs["col_width"] - page_specs["qr_size"]) / 2
             y_start = page_specs["margin-top"] + (page_specs["row_height"] - page_specs["qr_size"] - 0.5 * cm) / 2
 
             if not python_students:
                 c.showPage()
+
+            qr_forms = {}
             
             for i, student in enumerate(python_students):
                 try:
-                    qr_img = self.create_qr_image(student["id"], student["name"])
-                    img_buffer = io.BytesIO()
-                    qr_img.save(img_buffer, format="PNG")
-                    img_buffer.seek(0)
-                    img_reader = ImageReader(img_buffer)
-
                     pos_number = i + offset
                     col = pos_number % page_specs["num_cols"]
                     row = (pos_number // page_specs["num_cols"]) % page_specs["num_rows"]
@@ -106,7 +131,17 @@ class QRGenerator:
                     x = x_start + page_specs["col_width"] * col + page_specs["col_sep"] * col
                     y = y_start + row * page_specs["row_height"] + row * page_specs["row_sep"]
 
-                    c.drawImage(img_reader, x, y, page_specs["qr_size"], page_specs["qr_size"])
+                    if vector:
+                        qr_data = qr_payload(student)
+                        if qr_data not in qr_forms:
+                            qr_forms[qr_data] = f"qr{len(qr_forms)}"
+                            self._draw_qr_form(c, qr_forms[qr_data], self.create_qr_matrix(student["id"], student["name"]), page_specs["qr_size"])
+                        c.saveState()
+                        c.translate(x, y)
+                        c.doForm(qr_forms[qr_data])
+                        c.restoreState()
+                    else:
+                        self._draw_qr_image(c, student, x, y, page_specs["qr_size"])
                     font_size = 10
                     c.setFont("Helvetica", font_size)
 
@@ -124,9 +159,6 @@ class QRGenerator:
 
                     c.drawCentredString(text_x, text_y, name_to_print)
                     
-                    # Close image buffer
-                    img_buffer.close()
-                    
                 except Exception as e:
                     raise RuntimeError(f"Error processing student {student['name']}: {str(e)}")
                     continue  # Skip this student and continue with others
@@ -159,4 +191,48 @@ class QRGenerator:
         result = []
         for element in array:
             result.extend([element] * number_copies)
-        return result
\ No newline at end of file
+        return result
+
+
+def _generate_roster(job):
+    # One class of generate_qr_batch; module level so that it can run in a process pool
+    generator = QRGenerator(job["content"], job["name"])
+    try:
+        pdf_bytes = generator.generate_qr_pdf_bytes(job["copies"], job["offset_row"], job["offset_col"], job["vector"])
+    except Exception as e:
+        raise RuntimeError(f"Error generating QR codes for {job['name']}: {str(e)}")
+    return (generator.get_filename(), generator.class_name, pdf_bytes)
+
+
+def generate_qr_batch(rosters, copies=1, offset_row=1, offset_col=1, vector=True, as_zip=False, workers=1):
+    """Label sheets for several class lists at once. rosters is a list of {"name": csv file name,
+    "content": csv text}; returns {pdf file name: pdf bytes} in roster order, or one ZIP with as_zip.
+    Natively the classes are spread over a pool of `workers` processes."""
+    jobs = [{"name": roster["name"], "content": roster["content"], "copies": copies, "offset_row": offset_row,
+             "offset_col": offset_col, "vector": vector} for roster in rosters]
+    if workers > 1 and sys.platform != "emscripten" and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_generate_roster, jobs))
+    else:
+        results = [_generate_roster(job) for job in jobs]
+
+    pdfs = {}
+    for (job, (filename, class_name, pdf_bytes)) in zip(jobs, results):
+        if not class_name or filename in pdfs:
+            # No class in the file name or two lists of the same class: fall back to the CSV name
+            filename = "QR-Codes_" + os.path.splitext(os.path.basename(job["name"]))[0] + ".pdf"
+        # CSV files of the same name from different directories are numbered
+        (stem, counter) = (filename[:-len(".pdf")], 2)
+        while filename in pdfs:
+            filename = f"{stem}_{counter}.pdf"
+            counter += 1
+        pdfs[filename] = pdf_bytes
+    if not as_zip:
+        return pdfs
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for (filename, pdf_bytes) in pdfs.items():
+            zipf.writestr(filename, pdf_bytes)
+    return buffer.getvalue()
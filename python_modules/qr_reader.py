@@ -1,29 +1,107 @@
 import io
 import zipfile
+import zlib
 import time
 from datetime import datetime
-import fitz
-import cv2
-import js
+import sys
+import os
+import json
+import hashlib
+import importlib
 import asyncio
 import traceback
-import numpy as np
-from PyPDF2 import PdfMerger
-from PIL import Image
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import cm
-from reportlab.lib import colors
-from reportlab.pdfgen import canvas
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-
-class ExamReader : 
+import tracemalloc
+from collections import deque, OrderedDict
+
+from roster import Roster, qr_payload
+
+try:
+    import js
+except ImportError:
+    js = None  # running natively, outside Pyodide
+
+
+class _LazyModule :
+    # Imports the module on first use. Loading this file stays cheap, and code paths that never
+    # touch a library (e.g. shard workers and reportlab) do not need it installed.
+    def __init__ (self, name) :
+        self._name = name
+        self._module = None
+
+    def __getattr__ (self, attr) :
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+fitz = _LazyModule("fitz")
+cv2 = _LazyModule("cv2")
+np = _LazyModule("numpy")
+
+A4 = (595.2755905511812, 841.8897637795277)  # points, same as reportlab.lib.pagesizes.A4
+
+class ExamReader :
+    QR_SEARCH_SIZE = 1000       # longest side (px) of the downscaled frame used to locate QR codes
+    QR_CROP_MARGIN = 0.35       # quiet zone added around a candidate, relative to its size
+    QR_MAX_CANDIDATES = 6
+    MAX_SKEW = 15               # largest rotation (degrees) the reader tries to correct
+    ROTATION_SWEEP = [-3, 3, -6, 6, -9, 9, -12, 12, -15, 15]
+    MAX_PAGE_ROTATIONS = 8      # full-page warps allowed once all candidate crops failed
+    RECENT_ANGLES = 5           # successful angles remembered for the following pages
+    CHECKPOINT_VERSION = 1
+    YIELD_INTERVAL = 0.1        # seconds between yields to the event loop (worker messages, repaint)
+
     def __init__(self, pdf_files_data, scan_options):
             
-        options_dict = scan_options.to_py()
+        options_dict = scan_options.to_py() if hasattr(scan_options, 'to_py') else dict(scan_options)
+        self.scan_options = options_dict
         self.split_a3 = options_dict.get("split_a3", False)
+        # Split A3 spreads at the gap between their halves instead of the page center (off-center scans)
+        self.detect_gutter = options_dict.get("detect_gutter", False)
         self.two_page_scan = options_dict.get("two_page_scan", False)
         self.quick_and_dirty = options_dict.get("quick_and_dirty", False)
+        self.render_dpi = options_dict.get("render_dpi", 216)
+        # Page regions (x0, y0, x1, y1 as fractions of the page) where the QR label is expected
+        self.qr_regions = options_dict.get("qr_regions", None) or []
+        self.recent_angles = deque(maxlen=self.RECENT_ANGLES)
+        # Number of processes decoding pages in parallel (native only, see scan-worker.js for the browser)
+        self.decode_workers = options_dict.get("decode_workers", 1)
+        # ZIP entries: "auto" stores already compressed PDFs and deflates the rest, or "store" / "deflate"
+        self.zip_compression = options_dict.get("zip_compression", "auto")
+        self.zip_compresslevel = options_dict.get("zip_compresslevel", None)
+        # summary.pdf: "thumbnails" shows small previews of the pages per student, "full" copies every page
+        self.summary_mode = options_dict.get("summary_mode", "thumbnails")
+        self.decoded_pages = None  # Set by scan-worker.js when pages were decoded by shard workers
+        # Decode results of earlier runs. scan-worker.js sets a DecodeCache shared across scans,
+        # natively the cache can be kept in a file.
+        self.decode_cache_path = options_dict.get("decode_cache_path", None)
+        self.decode_cache = DecodeCache.load(self.decode_cache_path) if self.decode_cache_path else None
+        # Resolved pages are handed to checkpoint_callback every checkpoint_interval pages, so an
+        # interrupted scan can continue from there. Natively the checkpoint can be kept in a file.
+        self.checkpoint_interval = options_dict.get("checkpoint_interval", 10)
+        self.checkpoint_path = options_dict.get("checkpoint_path", None)
+        self.resume_checkpoint = None
+        # Set by ScanSession: student PDFs of the previous scan, student -> (page numbers, PDF, number of pages),
+        # and the dict this scan records its student PDFs in
+        self.previous_outputs = None
+        self.student_outputs = None
+        self.cancelled = False
+        self._next_page = None  # first page not resolved yet while _resolved_pages runs
+        # Profiling records per-page and per-stage timings and the peak memory in self.metrics
+        self.profiling = options_dict.get("profiling", False)
+        self.metrics = ScanMetrics() if self.profiling else None
+        self._page_metrics = None
+        # Debug messages are dropped right away unless log_debug is set
+        self.log_debug = options_dict.get("log_debug", False)
+        self._last_yield = time.monotonic()
+        # QR decoders in order of preference; unavailable ones are skipped. The order adapts during the scan.
+        self.qr_backends = options_dict.get("qr_backends", None) or DEFAULT_QR_BACKENDS
+        self.decoder = AdaptiveDecoder(create_qr_backends(self.qr_backends))
+        self.qr_locator = cv2.QRCodeDetector()  # only locates codes on the downscaled frame
+        # Class list (CSV as for QRGenerator). Decoded labels must belong to it, others are discarded.
+        roster_csv = options_dict.get("roster", None)
+        self.roster = Roster.from_csv(roster_csv) if roster_csv else None
+        self.students_without_pages = []
             
         self.pdf_files_data = pdf_files_data
         
@@ -31,15 +109,27 @@ class ExamReader :
         self.missing_pages = []
         self.log_callback = None  # Will be set by caller (main thread or worker)
         self.progress_callback = None  # Will be set by caller
+        self.zip_chunk_callback = None  # Set by the worker to stream the ZIP instead of collecting it
+        self.event_callback = None  # Receives the events of process_events() while process() runs
+        self.checkpoint_callback = None  # Receives the checkpoint as JSON text
+        self.message_batch = None  # Set by the worker to send logs and progress in batches, see MessageBatch
 
         self.logMsg("Reader initialized", "success")
 
-        self.fitz_source_pdf = self._merge_pdf(pdf_files_data)
-        self.in_memory_files = {} 
+        open_start = time.perf_counter()
+        self.source_pages = self._open_pdf_files(pdf_files_data)
+        self._add_stage_time("open", open_start)
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                self.resume_from(f.read())
 
     def logMsg(self, msg, type="info"):
-        # Use callback if available (worker mode), otherwise use DOM (main thread mode)
-        if self.log_callback:
+        if type == "debug" and not self.log_debug:
+            return
+        # Use batch or callback if available (worker mode), otherwise use DOM (main thread mode)
+        if self.message_batch:
+            self.message_batch.log(msg, type)
+        elif self.log_callback:
             self.log_callback(msg, type)
         else:
             try:
@@ -56,33 +146,114 @@ class ExamReader :
         
     async def logMsg_async(self, msg, type="info"):
         self.logMsg(msg, type)
-        await asyncio.sleep(0)
+        await self._yield_if_due()
 
     async def update_progress (self, percentage) :
-        if self.progress_callback:
+        if self.message_batch:
+            self.message_batch.set_progress(percentage)
+        elif self.progress_callback:
             self.progress_callback(percentage)
-        await asyncio.sleep(0)
+        await self._yield_if_due()
+
+    async def _yield_if_due (self) :
+        # Yielding lets the worker handle incoming messages such as SCAN_CANCEL and the page repaint.
+        # Doing it on every message costs more than it helps, a few times per second is enough.
+        now = time.monotonic()
+        if now - self._last_yield >= self.YIELD_INTERVAL:
+            self._last_yield = now
+            await asyncio.sleep(0)
 
     async def process(self) -> bool:
         # progress_callback should be set by caller before calling process()
+        if self.metrics:
+            self.metrics.start_memory_trace()
+        process_start = time.perf_counter()
         try:
-            self.pdf_page_array = await self._read_qr_codes()
-            self.student_page_map = self._create_student_page_map()
-
-            self.saveZipFile()
+            async for event in self.process_events():
+                if self.event_callback:
+                    self.event_callback(event)
             await self.update_progress(1)
+            if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+            if self.metrics:
+                self._add_stage_time("total", process_start)
+                self.metrics.backends = self.decoder.stats_dict()
+                self.logMsg(self.metrics.summary(), "info")
             return True
 
+        except ScanCancelled:
+            self.logMsg("Scan cancelled.", "warning")
+            return False
+
         except Exception as e:
             self.logMsg(f"Error: {str(e)}, Stack Trace: {traceback.format_exc()}")
             return False
 
+        finally:
+            if self.metrics:
+                self.metrics.stop_memory_trace()
+            if self.message_batch:
+                self.message_batch.flush()
 
-    def _merge_pdf(self, input_files) :
-        input_files = input_files.to_py()
-        self.logMsg("Input files converted for Python.", "success")
-        
-        merger = PdfMerger()
+    def get_metrics(self) :
+        # Timings of the last scan as plain data, or None without the profiling option
+        return self.metrics.to_dict() if self.metrics else None
+
+    def _add_stage_time(self, stage, start) :
+        if self.metrics:
+            self.metrics.add_stage(stage, time.perf_counter() - start)
+
+    def _add_page_metric(self, key, value) :
+        if self._page_metrics is not None:
+            self._page_metrics[key] = self._page_metrics.get(key, 0) + value
+
+
+    def cancel(self) :
+        # Called from outside while process() runs; the scan stops at the next page or stage
+        self.cancelled = True
+
+    def _check_cancelled(self) :
+        # Wherever the cancel is noticed, the pages resolved so far are kept in a checkpoint
+        if self.cancelled:
+            if self._next_page is not None:
+                self._save_checkpoint(self._next_page)
+            raise ScanCancelled()
+
+    async def process_events(self) :
+        # Yields a "page" event for every page in page order and a "student" event with the student's
+        # PDF as soon as a run of their pages ends, i.e. when the next page belongs to someone else.
+        # The ZIP entry and the summary section are written at the same moment, unless the student's
+        # pages are known to continue later in the stack (another file, a late stack). Then the PDF
+        # is a preview, and another event with the PDF of all their pages follows.
+        self.student_page_map = {}
+        self._begin_output()
+        segment_student = None
+        async for (page_num, page_info) in self._resolved_pages() :
+            yield {"type": "page", "page_num": page_num,
+                   "status": page_info["status"] if page_info else "missing",
+                   "value": page_info["value"] if page_info else None}
+            if page_info is None:
+                continue
+            student = page_info["value"]
+            if student != segment_student and segment_student is not None:
+                self._check_cancelled()
+                yield self._output_student(segment_student)
+            segment_student = student
+            self.student_page_map.setdefault(student, []).append(page_info)
+
+        self._check_cancelled()
+        if segment_student is not None:
+            yield self._output_student(segment_student)
+        self._check_cancelled()
+        self._finish_output()
+
+    def _open_pdf_files(self, input_files) :
+        # Every upload is opened in place; no merged copy of the scans is built.
+        if hasattr(input_files, 'to_py'):
+            input_files = input_files.to_py()
+            self.logMsg("Input files converted for Python.", "success")
+
+        source_pages = PageIndex()
         for file in input_files :
             try:
                 # File object with binary data
@@ -90,50 +261,154 @@ class ExamReader :
                 if hasattr(file_data, 'to_py'):
                     # Convert Pyodide object to Python
                     file_data = file_data.to_py()
-                file_buffer = io.BytesIO(bytes(file_data))
-                merger.append(file_buffer)
-                self.logMsg(f"Added file {file.get('name', 'unknown')} to merger", "debug")
+                file_data = bytes(file_data)
+                source_pages.add_document(fitz.open(stream=file_data, filetype="pdf"), file.get('name', 'unknown'), file_data)
+                self.logMsg(f"Added file {file.get('name', 'unknown')} to page index", "debug")
             except Exception as e:
-                self.logMsg(f"Error processing file in merger: {str(e)}", "error")
+                self.logMsg(f"Error opening file {file.get('name', 'unknown')}: {str(e)}", "error")
                 continue
-        
-        merged_buffer = io.BytesIO()
-        merger.write(merged_buffer)
-        merger.close()
-        merged_buffer.seek(0)
-        self.logMsg("PDFs merged in memory", "success")
-        return fitz.open(stream=merged_buffer.getvalue(), filetype="pdf")
+
+        self.logMsg(f"{len(source_pages)} pages from {len(source_pages.documents)} file(s) indexed", "success")
+        return source_pages
+
+    def page_count(self) -> int :
+        return len(self.source_pages)
+
+    def _source_files(self) :
+        return [{"name": name, "data": data} for (name, data) in zip(self.source_pages.names, self.source_pages.data)]
 
     def saveZipFile(self) : 
-        self.summary = []
-        preview_pdf = []
+        # Assembles all outputs for a complete student_page_map in one go; process_events()
+        # uses the same steps while pages are still being read.
+        self._begin_output()
         for student in self.student_page_map :
-            num_pages, student_file_data = self._create_student_pdf(student)
-            self.summary.append({
-                "Schüler/-in": student.split("_")[0], 
-                "Anzahl Seiten": num_pages}
-            )
-            preview_pdf.append([student, student_file_data])
-        self.summary_data = self._create_summary(preview_pdf)
-
-        # Create ZIP file in memory
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf :
-            for file_path, file_data in self.in_memory_files.items():
-                zipf.writestr(file_path, file_data)
-        
-        zip_buffer.seek(0)
-        self.zip_data = zip_buffer.getvalue()
+            self._output_student(student)
+        return self._finish_output()
+
+    def _begin_output(self) :
+        self.summary = []
+        self._summary_rows = {}  # student -> row of the summary table; names alone are not unique
+        self._written = {}  # student -> (source pages, PDF pages) in the ZIP and the summary
+        self._last_known_page = {}  # student -> last page known to be theirs before it is resolved
+        self._zip_chunks = []
+        self._zip_sink = ZipChunkSink(self.zip_chunk_callback or self._zip_chunks.append)
+        self._zipf = zipfile.ZipFile(self._zip_sink, 'w')
+        self._summary_fitz = fitz.open()
+        self._contact_sheet = ContactSheet(self._summary_fitz) if self.summary_mode == "thumbnails" else None
+
+    def _output_student(self, student) :
+        # PDF of all pages of the student read so far, straight from the source pages. It goes into
+        # the ZIP and the summary right away unless more of the student's pages are known to follow.
+        pages = self.student_page_map[student]
+        assemble_start = time.perf_counter()
+        page_nums = [page["page_num"] for page in pages]
+        previous = self.previous_outputs.get(student) if self.previous_outputs else None
+        reused = previous is not None and previous[0] == page_nums
+        student_fitz = None
+        if reused:
+            # Same pages as in the previous scan of the session
+            (_, pdf_data, num_pages) = previous
+        else:
+            student_fitz = self._create_student_pdf(pages)
+            num_pages = len(student_fitz)
+            pdf_data = student_fitz.tobytes()
+        self._add_stage_time("assemble", assemble_start)
+        if self._last_known_page.get(student, -1) <= page_nums[-1]:
+            self._write_student(student, pages, pdf_data, num_pages, student_fitz)
+        if student_fitz is not None:
+            student_fitz.close()
+        return {"type": "student", "student": student, "name": student.split("_")[0],
+                "num_pages": num_pages, "file_name": self._student_pdf_path(student), "pdf": pdf_data, "reused": reused}
+
+    def _write_student(self, student, pages, pdf_data, num_pages, student_fitz) :
+        # Summary section and ZIP entry of a student. Pages that turn up after that (not known in
+        # advance, e.g. in a later file) get a continuation section and a new ZIP entry with all pages.
+        name = student.split("_")[0]
+        continued = student in self._written
+        (summarized_pages, summarized_pdf_pages) = self._written.get(student, (0, 0))
+        summary_start = time.perf_counter()
+        title = f"Schüler/-in: {name}" + (" (Fortsetzung)" if continued else "")
+        if self._contact_sheet is not None:
+            self._contact_sheet.add_group(title, [self._thumbnail(page["page_num"], page["status"]) for page in pages[summarized_pages:]])
+        else:
+            self._add_separator_page(self._summary_fitz, title)
+            if student_fitz is None:
+                # PDF reused from the previous scan; its bytes are all there is
+                reused_fitz = fitz.open(stream=pdf_data, filetype="pdf")
+                self._summary_fitz.insert_pdf(reused_fitz, from_page=summarized_pdf_pages)
+                reused_fitz.close()
+            else:
+                self._summary_fitz.insert_pdf(student_fitz, from_page=summarized_pdf_pages)
+        self._add_stage_time("summary", summary_start)
+
+        path = self._student_pdf_path(student)
+        if continued:
+            self.logMsg(f"More pages of {name} after their PDF was written, it is replaced by one with all pages.", "debug")
+            self._drop_zip_entry(path)
+        self._write_zip_entry(path, pdf_data)
+        self._written[student] = (len(pages), num_pages)
+        self._summary_rows[student] = {"Schüler/-in": name, "Anzahl Seiten": num_pages}
+        if self.student_outputs is not None:
+            self.student_outputs[student] = ([page["page_num"] for page in pages], pdf_data, num_pages)
+
+    def _finish_output(self) :
+        if self.roster is not None:
+            # Students of the class list without a single page are listed in the summary with 0 pages
+            self.students_without_pages = self.roster.without_pages(self._written)
+            for student in self.students_without_pages:
+                self._summary_rows[qr_payload(student)] = {"Schüler/-in": student["name"], "Anzahl Seiten": 0}
+        self.summary = list(self._summary_rows.values())
+        summary_start = time.perf_counter()
+        self.summary_data = self._finish_summary(self._summary_fitz)
+        self._add_stage_time("summary", summary_start)
+        self._write_zip_entry("summary.pdf", self.summary_data)
+        self._zipf.close()
+        self._zip_sink.release()
+
+        # Without a chunk callback the archive is collected in memory
+        self.zip_data = None if self.zip_chunk_callback else b"".join(self._zip_chunks)
+        (self._zipf, self._zip_sink, self._zip_chunks, self._summary_fitz, self._contact_sheet) = (None, None, None, None, None)
         
-        self.logMsg("ZIP file created in memory", "info")
-        self.logMsg(f"Done. Created output for {len(self.student_page_map)} students.", "success")
+        self.logMsg("ZIP file created", "info")
+        self.logMsg(f"Done. Created output for {len(self._written)} students.", "success")
         # 1. Alert user if there are missing pages
         if hasattr(self, 'missing_pages') and self.missing_pages:
             warning_msg = f"Achtung: {len(self.missing_pages)} Seite(n) konnten keinem Schüler zugeordnet werden: {[p+1 for p in self.missing_pages]}. Bitte Zusammenfassung prüfen."
             self.logMsg(warning_msg, "warning")
+        if self.students_without_pages:
+            names = ", ".join(student["name"] for student in self.students_without_pages)
+            self.logMsg(f"Achtung: Für {len(self.students_without_pages)} Schüler/-innen der Klassenliste wurden keine Seiten gefunden: {names}", "warning")
         
         return self.zip_data
-    
+
+    def _write_zip_entry(self, path, data) :
+        zip_start = time.perf_counter()
+        self._zipf.writestr(path, data, compress_type=self._zip_compress_type(data), compresslevel=self.zip_compresslevel)
+        # Everything up to here is final; hand it out and free it
+        self._zip_sink.release()
+        self._add_stage_time("zip", zip_start)
+
+    def _drop_zip_entry(self, path) :
+        # The entry's data has been handed out already and stays in the archive, but the central
+        # directory no longer lists it, so a new entry can take its name
+        info = self._zipf.NameToInfo.pop(path)
+        self._zipf.filelist.remove(info)
+
+    def _zip_compress_type(self, data) :
+        if self.zip_compression == "store":
+            return zipfile.ZIP_STORED
+        if self.zip_compression == "deflate":
+            return zipfile.ZIP_DEFLATED
+        # auto: scanned pages are JPEG/CCITT already, deflating them costs CPU and saves nothing.
+        # Probe samples from the start, middle and end with the fastest level and only deflate
+        # when they actually shrink.
+        window = 16384
+        middle = max(0, len(data) // 2 - window // 2)
+        sample = data[:window] + data[middle:middle + window] + data[-window:]
+        if len(zlib.compress(sample, 1)) > 0.9 * len(sample):
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
     def get_zip_bytes(self):
         if hasattr(self, 'zip_data'):
             return self.zip_data
@@ -142,93 +417,261 @@ class ExamReader :
             return None
             
     def close(self):
-        self.fitz_source_pdf.close()
-        self.in_memory_files.clear()
+        self.source_pages.close()
             
     async def _extract_qr_code_from_page (self, page_number):
-        img_cv = self._open_page_cv(page_number)
-        detector = cv2.QRCodeDetector()
-        (h,w) = img_cv.shape[:2]
-        center = (w//2, h//2)
+        # Render only the regions where the label is expected first, the full page only if they miss
+        for (img_cv, x_offset, page_width) in self._page_frames(page_number):
+            (qr, side, angle) = await self._extract_qr_code_from_image(page_number, img_cv, x_offset, page_width)
+            if qr:
+                return (qr, side, angle)
+        return (None, None, None)
 
-        if getattr(self, 'quick_and_dirty', False):
-            angles = [0]
-        else:
-            angles = [0] + [i for i in range(-15, 16) if i != 0]
-        for angle in angles :
-            matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
-            rotated = cv2.warpAffine(img_cv, matrix, (w,h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    async def _extract_qr_code_from_image (self, page_number, img_cv, x_offset, page_width):
+        # Coarse-to-fine: locate candidates on a downscaled frame and decode full-resolution crops only.
+        # Rotating a crop is cheap, so the best candidate also gets the bounded sweep.
+        locate_start = time.perf_counter()
+        candidates = self._find_qr_candidates(img_cv, self.qr_locator)
+        self._add_page_metric("locate", time.perf_counter() - locate_start)
+        for i, ((x0, y0, x1, y1), skew) in enumerate(candidates):
+            crop = img_cv[y0:y1, x0:x1]
+            estimates = [] if skew is None else [skew]
+            for angle in self._rotation_order(estimates, sweep=(i == 0)):
+                decoded = self._detect_and_decode(self._rotate(crop, angle))
+                if decoded is None :
+                    continue
+                (data, cx) = decoded
+                return self._accept_qr_code(data, x_offset + x0 + cx, page_width, angle)
 
-            data, points, _ = detector.detectAndDecode(rotated)
-            if data == "" :
+        # Fallback: search the full page, most likely angles first. Full pages are expensive, so only
+        # the upright page gets every backend, the rotated ones only the currently best backend.
+        estimates = [skew for (_, skew) in candidates if skew is not None]
+        for angle in self._rotation_order(estimates, sweep=True)[:self.MAX_PAGE_ROTATIONS] :
+            decoded = self._detect_and_decode(self._rotate(img_cv, angle), all_backends=(angle == 0))
+            if decoded is None :
                 continue
-            
-            await self.logMsg_async(f"QR-Code on page {page_number+1} read. Student: {data.split('_')[0]}{f' (angle {angle})' if angle != 0 else ''}", "info")
-            data = data.replace("Teilnehmer/in", "")
 
-            cx = int(points[0][:,0].mean())
-            side = "left" if cx < w/2 else "right"
-            return (data, side)
-            
-        return (None, None)
+            (data, cx) = decoded
+            return self._accept_qr_code(data, x_offset + cx, page_width, angle)
+
+        return (None, None, None)
+
+    def _detect_and_decode (self, img, all_backends=True) :
+        # One decode attempt; rotating the image for it counts as part of the attempt
+        start = time.perf_counter()
+        decoded = self.decoder.decode(img, all_backends, accept=self._valid_payload)
+        self._add_page_metric("decode", time.perf_counter() - start)
+        self._add_page_metric("attempts", 1)
+        return decoded
+
+    def _valid_payload (self, data) :
+        # Decoded text as stored for the page. With a class list only its payloads are valid, a unique
+        # ID is enough; anything else is a misread and the search goes on.
+        data = data.replace("Teilnehmer/in", "")
+        if self.roster is None:
+            return data
+        payload = self.roster.match(data)
+        if payload is None:
+            self.logMsg(f"Discarded QR code {data!r}, it is not in the class list", "debug")
+        return payload
+
+    def _accept_qr_code (self, data, cx, page_width, angle) :
+        if angle != 0:
+            self.recent_angles.append(angle)
+        side = "left" if cx < page_width/2 else "right"
+        return (data, side, angle)
+
+    def _rotation_order (self, estimates, sweep=False) :
+        # Angle 0 first, then the estimated skew, then angles that worked on recent pages of this batch,
+        # then a coarse sweep. The detector tolerates a few degrees, so a coarse step is enough.
+        angles = [0] + list(estimates)
+        if not getattr(self, 'quick_and_dirty', False):
+            angles += reversed(self.recent_angles)
+            if sweep:
+                angles += self.ROTATION_SWEEP
+        return list(dict.fromkeys(angles))
+
+    def _rotate (self, img, angle) :
+        if angle == 0:
+            return img
+        (h, w) = img.shape[:2]
+        matrix = cv2.getRotationMatrix2D((w//2, h//2), angle, 1.0)
+        return cv2.warpAffine(img, matrix, (w,h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+    def _find_qr_candidates (self, img_cv, detector) :
+        # Returns full-resolution crop boxes (x0, y0, x1, y1) around likely QR codes with their
+        # estimated skew in degrees (or None), best first.
+        (h, w) = img_cv.shape[:2]
+        scale = min(1.0, self.QR_SEARCH_SIZE / max(h, w))
+        small = cv2.resize(img_cv, (int(w*scale), int(h*scale)), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        regions = []
+        found, points = detector.detect(small)
+        if found and points is not None:
+            corners = points.reshape(-1, 2).astype(np.float32)
+            regions.append((cv2.boundingRect(corners), self._estimate_skew(corners)))
+        regions.extend(self._find_dense_regions(small))
+
+        candidates = []
+        for ((x, y, bw, bh), skew) in regions:
+            margin = self.QR_CROP_MARGIN * max(bw, bh)
+            x0 = max(0, int((x - margin) / scale))
+            y0 = max(0, int((y - margin) / scale))
+            x1 = min(w, int((x + bw + margin) / scale))
+            y1 = min(h, int((y + bh + margin) / scale))
+            if any(x0 >= c[0] and y0 >= c[1] and x1 <= c[2] and y1 <= c[3] for (c, _) in candidates):
+                continue
+            candidates.append(((x0, y0, x1, y1), skew))
+        return candidates[:self.QR_MAX_CANDIDATES]
+
+    def _find_dense_regions (self, small) :
+        # QR codes show up as compact, roughly square blobs of strong black/white transitions.
+        (h, w) = small.shape[:2]
+        gradient = cv2.morphologyEx(small, cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8))
+        _, mask = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((7, 7), np.uint8))
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-    def _open_page_cv (self, page_number) :
-        zoom = 3
+        min_side = 0.02 * max(h, w)
+        max_side = 0.4 * max(h, w)
+        regions = []
+        for contour in contours:
+            (x, y, bw, bh) = cv2.boundingRect(contour)
+            if not (min_side <= bw <= max_side and min_side <= bh <= max_side):
+                continue
+            if not 0.6 <= bw / bh <= 1.6:
+                continue
+            fill = cv2.contourArea(contour) / (bw * bh)
+            if fill < 0.5:
+                continue
+            skew = self._estimate_skew(cv2.boxPoints(cv2.minAreaRect(contour)))
+            regions.append((fill, ((x, y, bw, bh), skew)))
+        regions.sort(key=lambda r: r[0], reverse=True)
+        return [region for (_, region) in regions]
+
+    def _estimate_skew (self, corners) :
+        # Skew of a quadrilateral (QR corners or a blob's min-area rectangle) as the rotation angle
+        # that straightens it. Squares repeat every 90 degrees, so fold into [-45, 45).
+        (x0, y0), (x1, y1) = corners[0], corners[1]
+        angle = np.degrees(np.arctan2(y1 - y0, x1 - x0))
+        angle = (angle + 45) % 90 - 45
+        angle = int(round(angle))
+        if angle == 0 or abs(angle) > self.MAX_SKEW:
+            return None
+        return angle
+
+    def _page_frames (self, page_number) :
+        # Yields (image, x offset, page width) with the offset and width in image pixels,
+        # so QR positions can be mapped back onto the full page.
+        page = self.source_pages[page_number]
+        render_start = time.perf_counter()
+        img_cv = self._embedded_page_image(page)
+        self._add_page_metric("render", time.perf_counter() - render_start)
+        if img_cv is not None:
+            (h, w) = img_cv.shape[:2]
+            for (rx0, ry0, rx1, ry1) in self.qr_regions:
+                yield (img_cv[int(ry0*h):int(ry1*h), int(rx0*w):int(rx1*w)], int(rx0*w), w)
+            yield (img_cv, 0, w)
+            return
+
+        zoom = self.render_dpi / 72
+        for (rx0, ry0, rx1, ry1) in self.qr_regions:
+            rect = page.rect
+            clip = fitz.Rect(rect.x0 + rx0 * rect.width, rect.y0 + ry0 * rect.height,
+                             rect.x0 + rx1 * rect.width, rect.y0 + ry1 * rect.height)
+            render_start = time.perf_counter()
+            region_cv = self._open_page_cv(page_number, clip)
+            self._add_page_metric("render", time.perf_counter() - render_start)
+            yield (region_cv, rx0 * rect.width * zoom, rect.width * zoom)
+        render_start = time.perf_counter()
+        img_cv = self._open_page_cv(page_number)
+        self._add_page_metric("render", time.perf_counter() - render_start)
+        yield (img_cv, 0, img_cv.shape[1])
+
+    def _embedded_page_image (self, page) :
+        # Copier scans are usually one image covering the whole page. Decoding that image directly
+        # skips rasterizing the page and avoids resampling it. Returns None for any other page.
+        if page.rotation != 0 or len(page.get_images()) != 1:
+            return None
+        infos = page.get_image_info(xrefs=True)
+        if len(infos) != 1 or not infos[0]["xref"]:
+            return None
+        (a, b, c, d, _, _) = infos[0]["transform"]
+        if a <= 0 or d <= 0 or abs(b) > 1e-3 or abs(c) > 1e-3:
+            return None  # rotated or mirrored placement
+        bbox = fitz.Rect(infos[0]["bbox"]) & page.rect
+        if bbox.get_area() < 0.95 * page.rect.get_area() or page.get_drawings():
+            return None
+
+        try:
+            pix = fitz.Pixmap(page.parent, infos[0]["xref"])
+            if pix.alpha:
+                pix = fitz.Pixmap(pix, 0)
+            if pix.n != 1:
+                pix = fitz.Pixmap(fitz.csGRAY, pix)
+        except Exception as e:
+            self.logMsg(f"Could not decode embedded image: {str(e)}", "debug")
+            return None
+
+        # Far more pixels than the render DPI would produce only slow the detector down
+        target_width = page.rect.width * self.render_dpi / 72
+        shrink = 0
+        while pix.width / 2**(shrink+1) >= target_width * 1.5:
+            shrink += 1
+        if shrink:
+            pix.shrink(shrink)
+        return np.asarray(_PixmapView(pix))[:, :pix.width]
+
+    def _open_page_cv (self, page_number, clip=None) :
+        zoom = self.render_dpi / 72
         mat = fitz.Matrix(zoom, zoom)
-        pix = self.fitz_source_pdf.load_page(page_number).get_pixmap(matrix=mat)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR) 
+        pix = self.source_pages[page_number].get_pixmap(matrix=mat, colorspace=fitz.csGRAY, alpha=False, clip=clip)
+        return np.asarray(_PixmapView(pix))[:, :pix.width]
         
     
     def get_summary_bytes(self) -> bytes:
         return self.summary_data
     
-    def _fitz_add_data(self, total_fitz, pdf_data) :
-        fitz_add = fitz.open(stream=pdf_data, filetype="pdf")
-        total_fitz.insert_pdf(fitz_add, from_page=0, to_page=len(fitz_add))
-        fitz_add.close()
-    
-    def _create_summary (self, preview_pdf) :
-        summary = self.summary
-        summary_title_data = self._build_summary_page()
-        summary_fitz = fitz.open()
-        self._fitz_add_data(summary_fitz, summary_title_data)
+    def _add_separator_page(self, target_fitz, text, pno=-1) :
+        page = target_fitz.new_page(pno=pno, width=A4[0], height=A4[1])
+        font_size = 32
+        text_width = fitz.get_text_length(text, fontname="hebo", fontsize=font_size)
+        page.insert_text(((A4[0] - text_width) / 2, A4[1] / 2), text, fontname="hebo", fontsize=font_size)
 
-        if hasattr(self, 'missing_pages') and self.missing_pages:
-            missing_name_buffer = io.BytesIO()
-            c = canvas.Canvas(missing_name_buffer, pagesize=A4)
-            c.setFont("Helvetica-Bold", 32)
-            c.drawCentredString(A4[0]/2, A4[1]/2, "Nicht eingelesene Seiten")
-            c.save()
-            missing_name_buffer.seek(0)
-            self._fitz_add_data(summary_fitz, missing_name_buffer.getvalue())
-
-            for missing_page_num in self.missing_pages:
-                summary_fitz.insert_pdf(self.fitz_source_pdf, from_page=missing_page_num, to_page=missing_page_num)
-
-        for (student, pdf_data) in preview_pdf :
-            name_page_buffer = io.BytesIO()
-            c = canvas.Canvas(name_page_buffer, pagesize=A4)
-            c.setFont("Helvetica-Bold", 32)
-            c.drawCentredString(A4[0]/2, A4[1]/2, f"Schüler/-in: {student.split('_')[0]}")
-            c.save()
-            name_page_buffer.seek(0)
-            self._fitz_add_data(summary_fitz, name_page_buffer.getvalue())
-            self._fitz_add_data(summary_fitz, pdf_data)
-
-        summary_buffer = io.BytesIO()
-        summary_fitz.save(summary_buffer)
+    def _thumbnail(self, page_num, status) :
+        return (self.source_pages[page_num], f"Seite {page_num+1}", status)
+
+    def _finish_summary (self, summary_fitz) :
+        # Unassigned pages are only known once all pages are read, they go in front of the students
+        if hasattr(self, 'missing_pages') and self.missing_pages and self.summary_mode == "thumbnails":
+            missing_fitz = fitz.open()
+            ContactSheet(missing_fitz).add_group("Nicht eingelesene Seiten", [self._thumbnail(p, "missing") for p in self.missing_pages])
+            summary_fitz.insert_pdf(missing_fitz, start_at=0)
+            missing_fitz.close()
+        elif hasattr(self, 'missing_pages') and self.missing_pages:
+            self._add_separator_page(summary_fitz, "Nicht eingelesene Seiten", pno=0)
+            for (i, missing_page_num) in enumerate(self.missing_pages):
+                self.source_pages.insert_page(summary_fitz, missing_page_num, start_at=i+1)
+
+        # The title page needs the page counts of all students, so it is put in front last
+        title_fitz = fitz.open(stream=self._build_summary_page(), filetype="pdf")
+        summary_fitz.insert_pdf(title_fitz, start_at=0)
+        title_fitz.close()
+
+        summary_data = summary_fitz.tobytes()
         summary_fitz.close()
-        summary_buffer.seek(0)
-        summary_data = summary_buffer.getvalue()
-        
-        # Store in in_memory_files for ZIP creation
-        self.in_memory_files["summary.pdf"] = summary_data
         self.logMsg("Summary PDF created in memory", "info")
         return summary_data
         
     
     def _build_summary_page (self):
+        from reportlab.lib.units import cm
+        from reportlab.lib import colors
+        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+        from reportlab.lib.styles import getSampleStyleSheet
+
         summary = self.summary
         output_buffer = io.BytesIO()
         doc = SimpleDocTemplate(output_buffer, pagesize=A4)
@@ -269,110 +712,795 @@ class ExamReader :
         else :
             elements.append(Paragraph(f"<b>Alle Seiten zugeordnet.</b>", styles['Normal']))
 
+        if self.summary_mode == "thumbnails":
+            elements.append(Spacer(1, 0.3*cm))
+            elements.append(Paragraph("Die folgenden Seiten zeigen verkleinerte Vorschauen der Seiten jeder Schülerin bzw. jedes Schülers. "
+                                      "<font color='orange'>Orange</font> umrandete Seiten haben keinen QR-Code und wurden der Vorseite zugeordnet, "
+                                      "<font color='red'>rot</font> umrandete Seiten konnten nicht zugeordnet werden.", styles['Normal']))
+
+        # 3. Students of the class list without pages
+        if self.students_without_pages:
+            names_str = ', '.join(student["name"] for student in self.students_without_pages)
+            elements.append(Paragraph(f"<b>Ohne Seiten:</b> {len(self.students_without_pages)} Schüler/-in(nen): {names_str}", styles['Normal']))
+
         doc.build(elements)
         output_buffer.seek(0)
         return output_buffer.getvalue()
     
-    def _create_student_pdf(self, student : str) -> int :
+    def _create_student_pdf(self, pages) :
+        # The page order is planned first; split halves are drawn straight into the output as clips
+        # of the source page, without intermediate documents.
         output_pdf = fitz.open()
         pdf_manager = PdfManager()
-        i=0
+        (layout, split_pairs) = pdf_manager.plan_pages(pages, self.split_a3)
+        for (outer, inner) in split_pairs:
+            self.logMsg(f"Pages {outer+1} and {inner+1} will be split.", "info")
 
-        while (i < len(self.student_page_map[student])):
-            page = self.student_page_map[student][i]
-            if not self.split_a3 or not page["size"] == "A3" or not i + 1 < len(self.student_page_map[student]):
-                output_pdf.insert_pdf(self.fitz_source_pdf, from_page=page["page_num"], to_page=page["page_num"])
-                i+=1
+        halves = {}
+        for (page_num, half) in layout:
+            if half is None:
+                self.source_pages.insert_page(output_pdf, page_num)
                 continue
+            if page_num not in halves:
+                page = self.source_pages[page_num]
+                page_image = self._embedded_page_image(page) if self.detect_gutter else None
+                halves[page_num] = pdf_manager.split_rects(page, self.detect_gutter, page_image)
+            self.source_pages.insert_clip(output_pdf, page_num, halves[page_num][half])
 
-            next_page = self.student_page_map[student][i+1]
-            if pdf_manager.is_splittable_pair(page, next_page) :
-                self.logMsg(f"Pages {page['page_num']+1} and {next_page['page_num']+1} will be split.", "info")
-                (output_page4, output_page1) = pdf_manager.split_a3(self.fitz_source_pdf, page["page_num"])
-                (output_page2, output_page3) = pdf_manager.split_a3(self.fitz_source_pdf, next_page["page_num"])
+        return output_pdf
 
-                for page in (output_page1, output_page2, output_page3, output_page4) :
-                    output_pdf.insert_pdf(page)
-                    page.close()
-                i+=2
-                continue
-
-            else :
-                output_pdf.insert_pdf(self.fitz_source_pdf, from_page=page["page_num"], to_page=page["page_num"])
-                i+=1
-                continue
-
-        num_pages = len(output_pdf)
+    def _student_pdf_path(self, student) :
         # Format: Participant_6028356_assignsubmission_file_
         student_id = student.split("_")[1]
         student_folder = "Participant_" + student_id + "_assignsubmission_file_"
-        
-        # Save to memory buffer instead of file
-        output_buffer = io.BytesIO()
-        output_pdf.save(output_buffer)
-        output_pdf.close()
-        output_buffer.seek(0)
-        pdf_data = output_buffer.getvalue()
-        
-        # Store in in_memory_files for ZIP creation
-        output_file_path = f"{student_folder}/{student}.pdf"
-        self.in_memory_files[output_file_path] = pdf_data
-        
-        return [num_pages, pdf_data]
+        return f"{student_folder}/{student}.pdf"
             
 
-    async def _read_qr_codes(self) :
-        pages_info = []
-        total_pages = len(self.fitz_source_pdf)
-        last_qr = None
+    async def _resolved_pages(self) :
+        # Yields (page_num, page_info) in page order, page_info is None for unassigned pages
+        self.pages_info = []
         self.missing_pages = []
-        pdf_manager = PdfManager()
+        self.last_qr = None
+        total_pages = len(self.source_pages)
 
-        for page_num in range (total_pages) : 
-            size = pdf_manager.detect_page_size(self.fitz_source_pdf[page_num])
-            (qr, side) = await self._extract_qr_code_from_page(page_num)
-            if qr:
-                page_info = {"page_num": page_num, "size": size, "status": "read", "value": qr, "side": side}
-                pages_info.append(page_info)
-                last_qr = qr
-
-            elif self.two_page_scan :
-                if not last_qr :
-                    self.logMsg_async(f"Error on page {page_num+1} of merged PDF: There seem to be two consecutive pages without QR-code or the first page does not have a QR code.", "error")
-                    self.missing_pages.append(page_num)
-                    continue
-                page_info = {"page_num": page_num, "size": size, "status": "from_previous", "value": last_qr, "side": "none"}
-                await self.logMsg_async(f"No QR code on page {page_num+1} of merged PDF. Inferred from previous page.", "info")
-                pages_info.append(page_info)
-                last_qr = None
+        start_page = self._restore_checkpoint()
+        self._next_page = start_page
+        # Students of the restored pages and of pages decoded by shard workers are known in advance;
+        # process_events holds back the output of a student whose pages continue there
+        for page_info in self.pages_info + list(self.decoded_pages or []):
+            if page_info["value"]:
+                self._last_known_page[page_info["value"]] = max(self._last_known_page.get(page_info["value"], -1), page_info["page_num"])
+        if start_page > 0:
+            if self.previous_outputs is not None:
+                await self.logMsg_async(f"Pages 1 to {start_page} are known from the previous scan, reading the added pages.", "info")
+            else:
+                await self.logMsg_async(f"Resuming the scan at page {start_page+1}.", "info")
+            # Pages of the checkpoint are not decoded again, but their students are assembled as usual
+            restored = {page_info["page_num"]: page_info for page_info in self.pages_info}
+            for page_num in range(start_page):
+                yield (page_num, restored.get(page_num))
 
-            else : 
-                await self.logMsg_async(f"Read error: Page {page_num+1} has no QR-Code and option two_page_scan is not active.", "error")
-                self.missing_pages.append(page_num)
-                continue
-            
-            if self.progress_callback:
-                await self.update_progress((page_num+1)/(total_pages+1))
+        # Pages are decoded independently (possibly in parallel), the two-page inference
+        # is applied afterwards in page order.
+        decode_start = time.perf_counter()
+        async for result in self._decoded_pages(list(range(start_page, total_pages))) :
+            # Only the time spent waiting for decode results; the consumer's time between pages is not counted
+            self._add_stage_time("decode", decode_start)
+            if self.metrics:
+                self.metrics.add_page(result["page_num"], result.get("metrics"))
+            self._check_cancelled()
+            page_info = await self._resolve_page(result)
+            self._next_page = result["page_num"] + 1
+            await self.update_progress((result["page_num"]+1)/(total_pages+1))
+            if (result["page_num"] + 1) % self.checkpoint_interval == 0:
+                self._save_checkpoint(result["page_num"] + 1)
+            yield (result["page_num"], page_info)
+            decode_start = time.perf_counter()
 
         if len(self.missing_pages) > 0:
             await self.logMsg_async("Some pages could not be assigned: " + str([i+1 for i in self.missing_pages]), "error")
         else :
             await self.logMsg_async("All QR codes read.", "info")
-        return pages_info
-    
-            
-    def _create_student_page_map(self) :
-        students = {}
-        for page in self.pdf_page_array :
-            if not page["value"] in students :
-                students[page["value"]] = []
 
-            students[page["value"]].append(page)
-        return students
+    def checkpoint(self, next_page) -> str :
+        # Compact state of the page resolution; everything else is rebuilt from the source pages
+        return json.dumps({
+            "version": self.CHECKPOINT_VERSION,
+            "fingerprint": self._input_fingerprint(),
+            "next_page": next_page,
+            "pages_info": self.pages_info,
+            "missing_pages": self.missing_pages,
+            "last_qr": self.last_qr,
+        }, separators=(",", ":"))
+
+    def resume_from(self, checkpoint_text) -> bool :
+        # Accepts a checkpoint of an earlier run if it was made for the same files and options
+        try:
+            checkpoint = json.loads(checkpoint_text)
+        except ValueError:
+            return False
+        if checkpoint.get("version") != self.CHECKPOINT_VERSION or checkpoint.get("fingerprint") != self._input_fingerprint():
+            self.logMsg("Checkpoint belongs to other files or options and is ignored.", "debug")
+            return False
+        self.resume_checkpoint = checkpoint
+        return True
+
+    def _save_checkpoint(self, next_page) :
+        if not (self.checkpoint_callback or self.checkpoint_path):
+            return
+        checkpoint = self.checkpoint(next_page)
+        if self.checkpoint_callback:
+            self.checkpoint_callback(checkpoint)
+        if self.checkpoint_path:
+            with open(self.checkpoint_path, "w", encoding="utf-8") as f:
+                f.write(checkpoint)
+
+    def _restore_checkpoint(self) -> int :
+        # Returns the first page that still has to be resolved
+        if self.resume_checkpoint is None:
+            return 0
+        checkpoint = self.resume_checkpoint
+        self.pages_info = list(checkpoint["pages_info"])
+        self.missing_pages = list(checkpoint["missing_pages"])
+        self.last_qr = checkpoint["last_qr"]
+        return checkpoint["next_page"]
+
+    def _resolution_options(self) :
+        # The options that change how pages are resolved; split_a3 and detect_gutter only affect the output
+        return (self.two_page_scan, self.quick_and_dirty, self.render_dpi, self.qr_regions, self._roster_digest())
+
+    def _input_fingerprint(self) :
+        # The files and the options that change how pages are resolved
+        digest = hashlib.sha256()
+        digest.update(repr(self._resolution_options()).encode())
+        for (name, data) in zip(self.source_pages.names, self.source_pages.data):
+            digest.update(name.encode())
+            digest.update(hashlib.sha256(data or b"").digest())
+        return digest.hexdigest()
+
+    def _file_keys(self) :
+        return [(name, hashlib.sha256(data or b"").hexdigest()) for (name, data) in zip(self.source_pages.names, self.source_pages.data)]
+
+    async def _decoded_pages(self, page_numbers) :
+        # Yields per-page decode results in page order, decoding only pages missing from the cache.
+        if self.decode_cache is None:
+            async for result in self._decode_uncached(page_numbers):
+                yield result
+            return
+
+        keys = {page_num: self._page_cache_key(page_num) for page_num in page_numbers}
+        cached = {}
+        for page_num in page_numbers:
+            result = self.decode_cache.get(keys[page_num])
+            if result is not None:
+                cached[page_num] = dict(result, page_num=page_num)
+        if cached:
+            await self.logMsg_async(f"{len(cached)} of {len(page_numbers)} pages found in the decode cache.", "info")
+
+        decoded = self._decode_uncached([p for p in page_numbers if p not in cached])
+        for page_num in page_numbers:
+            if page_num in cached:
+                yield cached[page_num]
+                continue
+            result = await decoded.__anext__()
+            self.decode_cache.put(keys[page_num], {k: v for (k, v) in result.items() if k not in ("page_num", "metrics")})
+            yield result
+
+        if self.decode_cache_path:
+            self.decode_cache.save(self.decode_cache_path)
+
+    def pages_to_decode(self) :
+        # Pages neither the checkpoint nor the decode cache can answer; scan-worker.js only shards these.
+        start_page = self.resume_checkpoint["next_page"] if self.resume_checkpoint else 0
+        if self.decode_cache is None:
+            return list(range(start_page, len(self.source_pages)))
+        return [p for p in range(start_page, len(self.source_pages)) if self.decode_cache.get(self._page_cache_key(p)) is None]
+
+    def _roster_digest (self) :
+        return self.roster.digest() if self.roster is not None else None
 
+    def _page_cache_key (self, page_num) :
+        # Hash of everything that determines the decode result: the page geometry, its content
+        # stream, the XObjects and images it draws, and the options that affect decoding.
+        page = self.source_pages[page_num]
+        doc = page.parent
+        digest = hashlib.sha256()
+        digest.update(repr((tuple(page.rect), page.rotation, self.render_dpi, self.quick_and_dirty, self.qr_regions, self._roster_digest())).encode())
+        digest.update(page.read_contents())
+        xrefs = [xobject[0] for xobject in page.get_xobjects()] + [image[0] for image in page.get_images(full=True)]
+        for xref in sorted(set(xrefs)):
+            digest.update(doc.xref_stream_raw(xref) or b"")
+        return digest.hexdigest()
+
+    async def _decode_uncached(self, page_numbers) :
+        # Yields per-page decode results in page order.
+        if self.decoded_pages is not None:
+            # Decoded by shard workers (scan-worker.js)
+            decoded = {result["page_num"]: result for result in self.decoded_pages}
+            for page_num in page_numbers:
+                yield decoded[page_num]
+
+        elif self.decode_workers > 1 and sys.platform != "emscripten" and len(page_numbers) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            loop = asyncio.get_running_loop()
+            with ProcessPoolExecutor(max_workers=self.decode_workers, initializer=_init_decode_worker,
+                                     initargs=(self._source_files(), self.scan_options)) as executor:
+                shards = [loop.run_in_executor(executor, _decode_shard, shard)
+                          for shard in self._shard_pages(page_numbers)]
+                for shard in shards:
+                    for result in await shard:
+                        yield result
+
+        else:
+            for page_num in page_numbers:
+                yield await self._decode_page(page_num)
+
+    def _shard_pages(self, page_numbers) :
+        # Small contiguous shards keep the workers balanced and results arrive roughly in order
+        shard_size = max(1, len(page_numbers) // (self.decode_workers * 4))
+        return [page_numbers[i:i+shard_size] for i in range(0, len(page_numbers), shard_size)]
+
+    async def decode_pages(self, page_numbers) :
+        # Entry point for shard workers: decode the given pages without resolving them.
+        results = []
+        for (i, page_num) in enumerate(page_numbers):
+            self._check_cancelled()
+            results.append(await self._decode_page(page_num))
+            await self.update_progress((i+1)/len(page_numbers))
+        return results
+
+    async def _decode_page(self, page_num) :
+        self._page_metrics = {} if self.profiling else None
+        size = PdfManager().detect_page_size(self.source_pages[page_num])
+        (qr, side, angle) = await self._extract_qr_code_from_page(page_num)
+        result = {"page_num": page_num, "size": size, "value": qr, "side": side, "angle": angle}
+        if self._page_metrics is not None:
+            # Travels with the result, so pages decoded by shard workers are measured as well
+            result["metrics"] = self._page_metrics
+            self._page_metrics = None
+        return result
+
+    async def _resolve_page(self, result) :
+        page_num = result["page_num"]
+        qr = result["value"]
+        if qr:
+            angle = result.get("angle") or 0
+            await self.logMsg_async(f"QR-Code on page {page_num+1} read. Student: {qr.split('_')[0]}{f' (angle {angle})' if angle != 0 else ''}", "info")
+            page_info = {"page_num": page_num, "size": result["size"], "status": "read", "value": qr, "side": result["side"]}
+            self.pages_info.append(page_info)
+            self.last_qr = qr
+            return page_info
+
+        elif self.two_page_scan :
+            if not self.last_qr :
+                await self.logMsg_async(f"Error on {self.source_pages.describe(page_num)}: There seem to be two consecutive pages without QR-code or the first page does not have a QR code.", "error")
+                self.missing_pages.append(page_num)
+                return
+            page_info = {"page_num": page_num, "size": result["size"], "status": "from_previous", "value": self.last_qr, "side": "none"}
+            await self.logMsg_async(f"No QR code on {self.source_pages.describe(page_num)}. Inferred from previous page.", "info")
+            self.pages_info.append(page_info)
+            self.last_qr = None
+            return page_info
+
+        else :
+            await self.logMsg_async(f"Read error: Page {page_num+1} has no QR-Code and option two_page_scan is not active.", "error")
+            self.missing_pages.append(page_num)
+
+
+
+class ScanCancelled (Exception) :
+    pass
+
+
+class ScanSession :
+    # Keeps the result of the last scan, so that scanning the same files plus a forgotten stack only
+    # reads the added pages: earlier pages keep their resolution without being decoded, and students
+    # whose pages did not change reuse their PDF. A student with pages in the added files gets one
+    # PDF rebuilt from the old and the new pages. The earlier files have to come first and unchanged,
+    # and the options that affect the page resolution have to be the same; otherwise the scan starts
+    # from scratch. PDFs are only reused if the output options (A3 splitting) are the same as well.
+    def __init__ (self) :
+        self.resolution_options = None
+        self.output_options = None
+        self.file_keys = []
+        self.state = None  # resolution of the scanned pages, as a checkpoint
+        self.student_outputs = {}
+
+    def reader (self, pdf_files_data, scan_options) :
+        reader = ExamReader(pdf_files_data, scan_options)
+        file_keys = reader._file_keys()
+        if (self.state is not None and reader._resolution_options() == self.resolution_options
+                and file_keys[:len(self.file_keys)] == self.file_keys):
+            reader.resume_checkpoint = self.state
+            if self._output_options(reader) == self.output_options:
+                reader.previous_outputs = self.student_outputs
+        reader.student_outputs = {}
+        return reader
+
+    def update (self, reader) :
+        # After reader.process() succeeded: its result is the base of the next scan
+        self.resolution_options = reader._resolution_options()
+        self.output_options = self._output_options(reader)
+        self.file_keys = reader._file_keys()
+        self.state = json.loads(reader.checkpoint(reader.page_count()))
+        self.student_outputs = reader.student_outputs
+
+    def reset (self) :
+        # The files were removed in the app; the next scan starts from scratch
+        self.__init__()
+
+    def _output_options (self, reader) :
+        return (reader.split_a3, reader.detect_gutter)
+
+
+class QRBackend :
+    # A QR decoder library. decode() returns (text, x center of the code in image pixels) or None.
+    name = None
+
+    def decode (self, img) :
+        raise NotImplementedError
+
+
+class OpenCVBackend (QRBackend) :
+    name = "opencv"
+
+    def __init__ (self) :
+        self.detector = cv2.QRCodeDetector()
+
+    def decode (self, img) :
+        data, points, _ = self.detector.detectAndDecode(img)
+        if data == "" or points is None:
+            return None
+        return (data, points[0][:,0].mean())
+
+
+class OpenCVArucoBackend (OpenCVBackend) :
+    # Finder patterns are located like ArUco markers (OpenCV 4.8+): more robust against skew and
+    # much faster at rejecting pages without a code.
+    name = "opencv_aruco"
+
+    def __init__ (self) :
+        self.detector = cv2.QRCodeDetectorAruco()
+
+
+class OpenCVMultiBackend (QRBackend) :
+    name = "opencv_multi"
+
+    def __init__ (self) :
+        self.detector = cv2.QRCodeDetector()
+
+    def decode (self, img) :
+        found, texts, points, _ = self.detector.detectAndDecodeMulti(img)
+        if not found:
+            return None
+        for (text, corners) in zip(texts, points):
+            if text:
+                return (text, corners[:,0].mean())
+        return None
+
+
+class WeChatBackend (QRBackend) :
+    # Only in opencv-contrib builds; without model files it falls back to the traditional detector
+    name = "wechat"
+
+    def __init__ (self) :
+        self.detector = cv2.wechat_qrcode_WeChatQRCode()
+
+    def decode (self, img) :
+        texts, points = self.detector.detectAndDecode(img)
+        for (text, corners) in zip(texts, points):
+            if text:
+                return (text, np.asarray(corners)[:,0].mean())
+        return None
+
+
+class ZXingBackend (QRBackend) :
+    name = "zxing"
+
+    def __init__ (self) :
+        import zxingcpp
+        self.zxingcpp = zxingcpp
+
+    def decode (self, img) :
+        for result in self.zxingcpp.read_barcodes(img, formats=self.zxingcpp.BarcodeFormat.QRCode):
+            if result.text:
+                position = result.position
+                return (result.text, (position.top_left.x + position.top_right.x + position.bottom_left.x + position.bottom_right.x) / 4)
+        return None
+
+
+class PyzbarBackend (QRBackend) :
+    name = "pyzbar"
+
+    def __init__ (self) :
+        from pyzbar import pyzbar
+        self.pyzbar = pyzbar
+
+    def decode (self, img) :
+        for symbol in self.pyzbar.decode(img, symbols=[self.pyzbar.ZBarSymbol.QRCODE]):
+            if symbol.data:
+                return (symbol.data.decode("utf-8"), symbol.rect.left + symbol.rect.width / 2)
+        return None
+
+
+QR_BACKENDS = {backend.name: backend for backend in
+               (OpenCVBackend, OpenCVArucoBackend, OpenCVMultiBackend, WeChatBackend, ZXingBackend, PyzbarBackend)}
+DEFAULT_QR_BACKENDS = ["opencv_aruco", "opencv", "wechat", "zxing", "pyzbar"]
+
+
+def create_qr_backends(names) :
+    # Backends whose library (or OpenCV build) is missing are left out
+    backends = []
+    for name in names:
+        try:
+            backends.append(QR_BACKENDS[name]())
+        except (ImportError, AttributeError, cv2.error):
+            continue
+    if not backends:
+        backends.append(OpenCVBackend())
+    return backends
+
+
+class AdaptiveDecoder :
+    # Tries the backends cheapest first, measured as the time spent in a backend per code it decoded
+    # in this run. Backends that have not decoded anything yet follow in their configured order.
+    def __init__ (self, backends) :
+        self.backends = list(backends)
+        self.stats = {backend.name: {"attempts": 0, "hits": 0, "seconds": 0.0} for backend in self.backends}
+
+    def ordered (self) :
+        def cost(item) :
+            (index, backend) = item
+            stats = self.stats[backend.name]
+            if stats["hits"] == 0:
+                return (1, index)
+            return (0, stats["seconds"] / stats["hits"])
+        return [backend for (_, backend) in sorted(enumerate(self.backends), key=cost)]
+
+    def decode (self, img, all_backends=True, accept=None) :
+        # accept(text) returns the text to use or None to discard the code and try the next backend
+        backends = self.ordered()
+        for backend in (backends if all_backends else backends[:1]):
+            stats = self.stats[backend.name]
+            start = time.perf_counter()
+            try:
+                decoded = backend.decode(img)
+            except cv2.error:
+                decoded = None
+            stats["seconds"] += time.perf_counter() - start
+            stats["attempts"] += 1
+            if decoded is not None and accept is not None:
+                data = accept(decoded[0])
+                decoded = None if data is None else (data, decoded[1])
+            if decoded is not None:
+                stats["hits"] += 1
+                return decoded
+        return None
+
+    def stats_dict (self) :
+        return {name: dict(stats) for (name, stats) in self.stats.items()}
+
+
+class MessageBatch :
+    # Collects log messages, progress updates and page events and hands them to send() together:
+    # when `interval` seconds have passed since the last batch or `max_messages` are waiting.
+    # Only the latest progress value of a batch is kept.
+    def __init__ (self, send, interval=0.1, max_messages=100) :
+        self.send = send
+        self.interval = interval
+        self.max_messages = max_messages
+        self.logs = []
+        self.pages = []
+        self.progress = None
+        self.last_flush = time.monotonic()
+
+    def log (self, msg, level) :
+        self.logs.append((str(msg), str(level)))
+        self._flush_if_due()
+
+    def set_progress (self, percentage) :
+        self.progress = float(percentage)
+        self._flush_if_due()
+
+    def add_page (self, event) :
+        self.pages.append(event)
+        self._flush_if_due()
+
+    def _flush_if_due (self) :
+        if len(self.logs) + len(self.pages) >= self.max_messages or time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush (self) :
+        if self.logs or self.pages or self.progress is not None:
+            self.send({"logs": self.logs, "pages": self.pages, "progress": self.progress})
+        self.logs = []
+        self.pages = []
+        self.progress = None
+        self.last_flush = time.monotonic()
+
+
+class ScanMetrics :
+    # Timings of one scan, recorded by ExamReader with the profiling option.
+    # Stages: open, decode, assemble (student PDFs), summary, zip, total; all in seconds.
+    # Pages: render, locate (candidate search), decode (detector calls) in seconds and decode attempts.
+    PAGE_KEYS = ("render", "locate", "decode", "attempts")
+
+    def __init__ (self) :
+        self.stages = {}
+        self.pages = {}
+        self.peak_memory = None
+        self.backends = {}
+        self._tracing = False
+
+    def add_stage (self, stage, seconds) :
+        self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+    def add_page (self, page_num, page_metrics) :
+        # Pages without metrics were answered by the decode cache
+        self.pages[page_num] = dict(page_metrics) if page_metrics else {"cached": True}
+
+    def start_memory_trace (self) :
+        # Python and numpy allocations only; MuPDF and OpenCV allocate outside of tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        tracemalloc.reset_peak()
+
+    def stop_memory_trace (self) :
+        if tracemalloc.is_tracing():
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def page_totals (self) :
+        return {key: sum(page.get(key, 0) for page in self.pages.values()) for key in self.PAGE_KEYS}
+
+    def to_dict (self) :
+        return {
+            "stages": dict(self.stages),
+            "page_totals": self.page_totals(),
+            "pages": [dict(self.pages[page_num], page_num=page_num) for page_num in sorted(self.pages)],
+            "cached_pages": sum(1 for page in self.pages.values() if page.get("cached")),
+            "backends": self.backends,
+            "peak_memory_mb": None if self.peak_memory is None else self.peak_memory / 2**20,
+        }
+
+    def summary (self) -> str :
+        stages = self.stages
+        totals = self.page_totals()
+        memory = "" if self.peak_memory is None else f", peak memory {self.peak_memory / 2**20:.0f} MB"
+        return (f"Timings: open {stages.get('open', 0):.1f}s, decode {stages.get('decode', 0):.1f}s "
+                f"(render {totals['render']:.1f}s, locate {totals['locate']:.1f}s, detector {totals['decode']:.1f}s "
+                f"in {totals['attempts']} attempts), student PDFs {stages.get('assemble', 0):.1f}s, "
+                f"summary {stages.get('summary', 0):.1f}s, ZIP {stages.get('zip', 0):.1f}s, "
+                f"total {stages.get('total', 0):.1f}s{memory}")
+
+
+class ContactSheet :
+    # Summary pages with downscaled thumbnails of the scanned pages, grouped under a title per student.
+    # Pages that were inferred from the previous page or could not be assigned get a colored frame.
+    COLUMNS = 4
+    MARGIN = 36
+    GAP = 10
+    TITLE_HEIGHT = 24
+    CAPTION_HEIGHT = 12
+    OVERSAMPLING = 2            # thumbnail pixels per point of the displayed size
+    JPEG_QUALITY = 60
+    MARKS = {
+        "from_previous": ((1.0, 0.55, 0.0), "ohne QR-Code"),
+        "missing": ((0.85, 0.0, 0.0), "nicht zugeordnet"),
+    }
+
+    def __init__ (self, doc) :
+        self.doc = doc
+        self.page = None
+        self.y = 0
+        self.cell_width = (A4[0] - 2 * self.MARGIN - (self.COLUMNS - 1) * self.GAP) / self.COLUMNS
+        self.cell_height = self.cell_width * A4[1] / A4[0]
+        self.row_height = self.cell_height + self.CAPTION_HEIGHT + self.GAP
+
+    def add_group (self, title, thumbnails) :
+        # thumbnails: (source page, caption, page status) in order
+        if self.page is None or self.y + self.TITLE_HEIGHT + self.row_height > A4[1] - self.MARGIN:
+            self._new_page()
+        self._title(title)
+        for (i, (source_page, caption, status)) in enumerate(thumbnails):
+            column = i % self.COLUMNS
+            if column == 0 and i > 0:
+                self.y += self.row_height
+                if self.y + self.row_height > A4[1] - self.MARGIN:
+                    self._new_page()
+                    self._title(title + " (Forts.)")
+            x = self.MARGIN + column * (self.cell_width + self.GAP)
+            self._draw_thumbnail(fitz.Rect(x, self.y, x + self.cell_width, self.y + self.cell_height), source_page, caption, status)
+        self.y += self.row_height
+
+    def _new_page (self) :
+        self.page = self.doc.new_page(width=A4[0], height=A4[1])
+        self.y = self.MARGIN
+
+    def _title (self, text) :
+        self.page.insert_text((self.MARGIN, self.y + 14), text, fontname="hebo", fontsize=12)
+        self.y += self.TITLE_HEIGHT
+
+    def _draw_thumbnail (self, cell, source_page, caption, status) :
+        # Fits the page into the cell keeping its aspect ratio; JPEG keeps the summary small
+        rect = source_page.rect
+        scale = min(cell.width / rect.width, cell.height / rect.height)
+        (width, height) = (rect.width * scale, rect.height * scale)
+        target = fitz.Rect(cell.x0 + (cell.width - width) / 2, cell.y0, cell.x0 + (cell.width + width) / 2, cell.y0 + height)
+        zoom = scale * self.OVERSAMPLING
+        pix = source_page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+        self.page.insert_image(target, stream=pix.tobytes("jpg", jpg_quality=self.JPEG_QUALITY))
+
+        (color, label) = self.MARKS.get(status, ((0.6, 0.6, 0.6), None))
+        self.page.draw_rect(target, color=color, width=2.5 if label else 0.5)
+        if label:
+            caption = f"{caption} - {label}"
+        self.page.insert_text((target.x0, target.y1 + 10), caption, fontname="helv", fontsize=8, color=color if label else (0, 0, 0))
+
+
+class ZipChunkSink :
+    # Seekable file object for zipfile that only buffers the entry being written. zipfile seeks back
+    # to patch the local header of the current entry, so everything written before the last
+    # release() is final and is handed to chunk_callback and freed.
+    def __init__ (self, chunk_callback) :
+        self.chunk_callback = chunk_callback
+        self.buffer = bytearray()
+        self.offset = 0     # absolute position of buffer[0]
+        self.position = 0
+
+    def write (self, data) :
+        start = self.position - self.offset
+        self.buffer[start:start + len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def tell (self) :
+        return self.position
+
+    def seek (self, position, whence=0) :
+        if whence == 1:
+            position += self.position
+        elif whence == 2:
+            position += self.offset + len(self.buffer)
+        if position < self.offset:
+            raise OSError("ZipChunkSink cannot seek into released data")
+        self.position = position
+        return position
+
+    def flush (self) :
+        pass
+
+    def release (self) :
+        if self.buffer:
+            self.chunk_callback(bytes(self.buffer))
+            self.offset += len(self.buffer)
+            self.buffer = bytearray()
+
+
+class DecodeCache :
+    # LRU cache of per-page decode results (value, side, angle, size), keyed by page content hash
+    VERSION = 1
+
+    def __init__ (self, max_entries=5000) :
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get (self, key) :
+        result = self.entries.get(key)
+        if result is not None:
+            self.entries.move_to_end(key)
+        return result
+
+    def put (self, key, result) :
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __len__ (self) :
+        return len(self.entries)
+
+    def to_json (self) -> str :
+        return json.dumps({"version": self.VERSION, "entries": list(self.entries.items())})
+
+    @classmethod
+    def from_json (cls, text, max_entries=5000) :
+        cache = cls(max_entries)
+        if text:
+            data = json.loads(text)
+            if data.get("version") == cls.VERSION:
+                for (key, result) in data["entries"]:
+                    cache.put(key, result)
+        return cache
+
+    def save (self, path) :
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_json())
+
+    @classmethod
+    def load (cls, path, max_entries=5000) :
+        if not os.path.exists(path):
+            return cls(max_entries)
+        with open(path, encoding="utf-8") as f:
+            return cls.from_json(f.read(), max_entries)
+
+
+_decode_worker_reader = None
+
+def _init_decode_worker(source_files, scan_options) :
+    # Runs once in every decode process; each process opens the inputs itself.
+    global _decode_worker_reader
+    _decode_worker_reader = ExamReader(source_files, dict(scan_options, decode_cache_path=None))
+    _decode_worker_reader.log_callback = lambda msg, type="info": None
+
+def _decode_shard(page_numbers) :
+    return asyncio.run(_decode_worker_reader.decode_pages(page_numbers))
+
+
+class PageIndex :
+    # Virtual page index over several input PDFs: global page number -> (document, local page number)
+    def __init__ (self) :
+        self.documents = []
+        self.names = []
+        self.data = []
+        self.pages = []
+
+    def add_document (self, doc, name, data=None) :
+        doc_index = len(self.documents)
+        self.documents.append(doc)
+        self.names.append(name)
+        self.data.append(data)
+        self.pages.extend((doc_index, local) for local in range(len(doc)))
+
+    def __len__ (self) :
+        return len(self.pages)
+
+    def __getitem__ (self, page_num) :
+        (doc, local) = self.locate(page_num)
+        return doc.load_page(local)
+
+    def locate (self, page_num) :
+        (doc_index, local) = self.pages[page_num]
+        return (self.documents[doc_index], local)
+
+    def describe (self, page_num) :
+        (doc_index, local) = self.pages[page_num]
+        return f"page {local+1} of {self.names[doc_index]}"
+
+    def insert_page (self, target_pdf, page_num, start_at=-1) :
+        (doc, local) = self.locate(page_num)
+        target_pdf.insert_pdf(doc, from_page=local, to_page=local, start_at=start_at)
+
+    def insert_clip (self, target_pdf, page_num, clip) :
+        # Appends a page showing only the clip of the source page, e.g. one half of an A3 spread
+        (doc, local) = self.locate(page_num)
+        page = target_pdf.new_page(width=clip.width, height=clip.height)
+        page.show_pdf_page(page.rect, doc, local, clip=clip)
+
+    def close (self) :
+        for doc in self.documents:
+            doc.close()
+
+
+class _PixmapView :
+    # Exposes a single-channel pixmap's samples to NumPy without copying. The array keeps this
+    # object, and thereby the pixmap owning the memory, alive.
+    def __init__ (self, pix) :
+        self.pix = pix
+        self.__array_interface__ = {
+            "shape": (pix.height, pix.stride),
+            "typestr": "|u1",
+            "data": (pix.samples_ptr, True),
+            "version": 3,
+        }
 
 
 class PdfManager : 
+    MIN_GUTTER_WIDTH = 6        # points; narrower gaps between content are not taken for the gutter
+
     def __init__ (self):
         pass
 
@@ -398,18 +1526,80 @@ class PdfManager :
         return (page1["status"] == "read" and
             (page1["side"] == "left" and page2["side"] == "right") or (page2["side"] == "none"))
        
-    def split_a3(self, fitz_pdf, page_num) :
-        fitz_page = fitz_pdf[page_num]
-        rect = fitz_page.rect
-        left_rect = fitz.Rect(rect.x0, rect.y0, rect.x1 / 2, rect.y1)
-        right_rect = fitz.Rect(rect.x1 / 2, rect.y0, rect.x1, rect.y1)
+    def plan_pages(self, pages, split_a3) :
+        # Output order of a student's pages as (page_num, half), half being None, "left" or "right".
+        # A splittable pair of A3 spreads is a folded booklet: the outer sheet holds pages 4|1,
+        # the inner sheet 2|3. Also returns the split pairs as (outer, inner) page numbers.
+        layout = []
+        split_pairs = []
+        i = 0
+        while i < len(pages):
+            page = pages[i]
+            if split_a3 and page["size"] == "A3" and i + 1 < len(pages) and self.is_splittable_pair(page, pages[i+1]):
+                (outer, inner) = (page["page_num"], pages[i+1]["page_num"])
+                layout += [(outer, "right"), (inner, "left"), (inner, "right"), (outer, "left")]
+                split_pairs.append((outer, inner))
+                i += 2
+            else:
+                layout.append((page["page_num"], None))
+                i += 1
+        return (layout, split_pairs)
 
-        left_page = fitz.open()
-        left_page1 = left_page.new_page(width=left_rect.width, height=left_rect.height)
-        left_page1.show_pdf_page(left_page1.rect, fitz_pdf, page_num, clip=left_rect)
+    def split_rects(self, page, detect_gutter=False, page_image=None) :
+        # Left and right half of a spread, by default split at the center of the page
+        rect = page.rect
+        gutter = self.find_gutter(page, page_image=page_image) if detect_gutter else (rect.x0 + rect.x1) / 2
+        return {"left": fitz.Rect(rect.x0, rect.y0, gutter, rect.y1),
+                "right": fitz.Rect(gutter, rect.y0, rect.x1, rect.y1)}
+
+    def find_gutter(self, page, window=0.15, page_image=None) :
+        # x of the gap between the halves of a spread, from the bounding boxes of the drawn content
+        # (text, paths, images) instead of rendering: the center of the widest vertical strip without
+        # content within `window` of the page center. A scan is usually one image covering the page;
+        # its gap is looked up in page_image, the embedded image as a grayscale array (see
+        # ExamReader._embedded_page_image). Falls back to the page center.
+        rect = page.rect
+        center = (rect.x0 + rect.x1) / 2
+        (lo, hi) = (center - window * rect.width, center + window * rect.width)
+        covered = []
+        image_bbox = None
+        for (_, bbox) in page.get_bboxlog():
+            bbox = fitz.Rect(bbox) & rect
+            if bbox.is_empty:
+                continue
+            if bbox.width > 0.9 * rect.width:
+                # Page-sized background or the scanned image itself
+                image_bbox = bbox
+                continue
+            if bbox.x1 > lo and bbox.x0 < hi:
+                covered.append((max(bbox.x0, lo), min(bbox.x1, hi)))
+        if not covered:
+            if page_image is not None and image_bbox is not None:
+                return self._image_gutter(page_image, image_bbox, lo, hi)
+            return center
 
-        right_page = fitz.open()
-        right_page2 = right_page.new_page(width=right_rect.width, height=right_rect.height)
-        right_page2.show_pdf_page(right_page2.rect, fitz_pdf, page_num, clip=right_rect)
+        best = (0, center)
+        x = lo
+        for (x0, x1) in sorted(covered) + [(hi, hi)]:
+            if x0 - x > best[0]:
+                best = (x0 - x, (x + x0) / 2)
+            x = max(x, x1)
+        return best[1] if best[0] >= self.MIN_GUTTER_WIDTH else center
 
-        return (left_page, right_page)
\ No newline at end of file
+    def _image_gutter(self, image, bbox, lo, hi) :
+        # Column projection of the image between lo and hi (page coordinates): the gutter is the
+        # middle of the lightest band of MIN_GUTTER_WIDTH, mapped back through the image's bbox
+        scale = image.shape[1] / bbox.width
+        (c0, c1) = (max(0, int((lo - bbox.x0) * scale)), min(image.shape[1], int((hi - bbox.x0) * scale)))
+        band = max(1, round(self.MIN_GUTTER_WIDTH * scale))
+        if c1 - c0 <= band:
+            return (bbox.x0 + bbox.x1) / 2
+        ink = 255 - image[:, c0:c1].mean(axis=0)
+        smoothed = np.convolve(ink, np.ones(band) / band, mode="valid")
+        # A gap wider than the band is a run of (nearly) equal minima; take its middle
+        first = int(np.argmin(smoothed))
+        last = first
+        while last + 1 < len(smoothed) and smoothed[last + 1] <= smoothed[first] + 1:
+            last += 1
+        column = c0 + (first + last + band) / 2
+        return bbox.x0 + column / scale
\ No newline at end of file
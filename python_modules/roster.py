@@ -0,0 +1,59 @@
+# Class lists as exported from the LMS (CSV: participant ID, name). QRGenerator prints the labels
+# from them, ExamReader checks the decoded labels against them.
+
+import csv
+import hashlib
+import io
+from collections import Counter
+
+
+def parse_roster(csv_content):
+    students = []
+    csv_reader = csv.DictReader(io.StringIO(csv_content), delimiter=',')
+    string_id = csv_reader.fieldnames[0]
+    string_name = csv_reader.fieldnames[1]
+
+    for row in csv_reader:
+        row[string_id] = row[string_id].replace("Teilnehmer/in", "")
+        students.append({
+            'id': row[string_id],
+            'name': row[string_name]
+        })
+    return students
+
+
+def qr_payload(student):
+    # Text encoded in a student's label
+    return student["name"] + "_" + student["id"]
+
+
+class Roster:
+    # Hash index of the label payloads of a class list
+    def __init__(self, students):
+        self.students = list(students)
+        self.payloads = {qr_payload(student): student for student in self.students}
+        id_counts = Counter(student["id"] for student in self.students)
+        self.by_id = {student["id"]: qr_payload(student) for student in self.students if id_counts[student["id"]] == 1}
+
+    @classmethod
+    def from_csv(cls, csv_content):
+        return cls(parse_roster(csv_content))
+
+    def __len__(self):
+        return len(self.students)
+
+    def match(self, data):
+        """Payload of the student a decoded text belongs to, or None if it is not on the list.
+        The ID after the last underscore is enough when it is unique; decoders sometimes garble
+        the name (umlauts in the wrong encoding) while the digits survive."""
+        if data in self.payloads:
+            return data
+        student_id = data.rsplit("_", 1)[-1].strip()
+        return self.by_id.get(student_id)
+
+    def without_pages(self, found_payloads):
+        # Students in list order whose payload never occurred
+        return [student for student in self.students if qr_payload(student) not in found_payloads]
+
+    def digest(self):
+        return hashlib.sha256(repr(sorted(self.payloads)).encode()).hexdigest()
@@ -6,120 +6,138 @@ importScripts('https://cdn.jsdelivr.net/pyodide/v0.28.3/full/pyodide.js');
 
 let pyodide = null;
 let ExamReader = null;
-let isInitialized = false;
+let decodeCache = null;  // Python DecodeCache shared by all scans of this session
+let currentReader = null;  // ExamReader of the running scan, for SCAN_CANCEL
+let shardWorkers = [];  // Shard workers of the running scan
+let scanCheckpoint = null;  // Latest checkpoint (JSON text) of an interrupted scan
+let persistCheckpoint = false;
+let scanSession = null;  // Python ScanSession: scanning again with added files only reads the new pages
 
-// Initialize Pyodide and load Python modules
-async function initialize() {
-    if (isInitialized) return;
-    
+// Packages and Python modules per feature. Features are loaded on first use, so generating QR labels
+// does not wait for OpenCV and PyMuPDF. Shard workers only need 'decode'.
+const FEATURES = {
+    qr: { requires: [], packages: ['Pillow', 'reportlab', 'qrcode'], modules: ['roster.py', 'qr_generator.py'] },
+    decode: { requires: [], packages: ['numpy', 'opencv-python', 'PyMuPDF'], modules: ['roster.py', 'qr_reader.py'] },
+    scan: { requires: ['decode'], packages: ['reportlab'], modules: [] }
+};
+const featureLoads = {};
+let pyodideLoad = null;
+let micropip = null;
+
+// Initialize Pyodide and micropip; the packages come with the features
+function initialize() {
+    if (!pyodideLoad) {
+        pyodideLoad = loadPyodideCore().catch(error => {
+            pyodideLoad = null;
+            throw error;
+        });
+    }
+    return pyodideLoad;
+}
+
+async function loadPyodideCore() {
     try {
         postMessage({ type: 'LOG', message: 'Loading Pyodide in worker...', level: 'info' });
+        postMessage({ type: 'INIT_PROGRESS', package: 'Pyodide', current: 1, total: 2 });
         
         // Load Pyodide
         pyodide = await loadPyodide({
             indexURL: 'https://cdn.jsdelivr.net/pyodide/v0.28.3/full/'
         });
         
-        postMessage({ type: 'INIT_PROGRESS', package: 'Pyodide', current: 1, total: 'n'});
-        
-        // Install required packages
+        postMessage({ type: 'INIT_PROGRESS', package: 'micropip', current: 2, total: 2 });
         await pyodide.loadPackage(['micropip']);
-        const micropip = pyodide.pyimport('micropip');
-        
-        // Install packages one by one with progress updates
-        const packages = [
-            'Pillow',
-            'reportlab', 
-            'PyPDF2',
-            'PyMuPDF',
-            'opencv-python',
-            'qrcode',
-            'numpy'
-        ];        
-        
-        const modules = [
-            { name: 'qr_reader.py', path: './python_modules/qr_reader.py' },
-            { name: 'pdf_manager.py', path: './python_modules/pdf_manager.py' },
-            { name: 'qr_generator.py', path: './python_modules/qr_generator.py' }
-        ];
-        
-        const totalSteps = 1 + packages.length + modules.length;
-
-        let iStep = 0;
-        for (iStep = 0; iStep < packages.length; iStep++) {
-            const pkg = packages[iStep];
-            postMessage({ 
-                type: 'INIT_PROGRESS', 
-                package: pkg, 
-                current: iStep + 2, 
-                total: totalSteps
-            });
-            await micropip.install(pkg);
-        }
-        
-        postMessage({ type: 'LOG', message: 'Loading Python modules...', level: 'info' });
-        
-        // Load Python module files
-
-        
-        for (const module of modules) {
-            try {
-                const response = await fetch(module.path);
-                if (!response.ok) throw new Error(`Failed to load ${module.name}`);
-                const code = await response.text();
-                pyodide.runPython(code);
-                iStep++;
-                postMessage({ 
-                    type: 'INIT_PROGRESS', 
-                    package: module.name, 
-                    current: iStep + 1, 
-                    total: totalSteps
-                });
-            } catch (error) {
-                postMessage({ 
-                    type: 'ERROR', 
-                    message: `Failed to load ${module.name}: ${error.message}` 
-                });
-                throw error;
-            }
-        }
-        
-        // Get the ExamReader class
-        ExamReader = pyodide.globals.get('ExamReader');
+        micropip = pyodide.pyimport('micropip');
         
-        isInitialized = true;
         postMessage({ type: 'INITIALIZED' });
         postMessage({ type: 'LOG', message: 'Worker initialized successfully', level: 'success' });
         
     } catch (error) {
         postMessage({ 
             type: 'ERROR', 
-            message: `Initialization failed: ${error.message}` 
+            message: `Initialization error: ${error.message}` 
         });
         throw error;
     }
 }
 
+function loadFeature(name) {
+    if (!featureLoads[name]) {
+        featureLoads[name] = installFeature(name).catch(error => {
+            delete featureLoads[name];
+            throw error;
+        });
+    }
+    return featureLoads[name];
+}
+
+async function installFeature(name) {
+    const feature = FEATURES[name];
+    await initialize();
+    await Promise.all(feature.requires.map(loadFeature));
+
+    postMessage({ type: 'FEATURE_LOADING', feature: name, packages: feature.packages });
+    // The module sources are fetched while micropip resolves and downloads all packages at once.
+    // Wheels come from the versioned CDN URLs and are kept by the browser's HTTP cache.
+    const sources = Promise.all(feature.modules.map(async (module) => {
+        const response = await fetch(`./python_modules/${module}`);
+        if (!response.ok) throw new Error(`Failed to load ${module}`);
+        return response.text();
+    }));
+    await micropip.install(feature.packages);
+    const codes = await sources;
+    // The modules also go to the home directory, which is on sys.path, so they can import each other
+    feature.modules.forEach((module, i) => pyodide.FS.writeFile(`/home/pyodide/${module}`, codes[i]));
+    for (const code of codes) {
+        pyodide.runPython(code);
+    }
+
+    if (name === 'decode') {
+        // Get the ExamReader class
+        ExamReader = pyodide.globals.get('ExamReader');
+    }
+    postMessage({ type: 'FEATURE_READY', feature: name });
+}
+
 // Handle messages from main thread
 self.onmessage = async function(event) {
     const { type, data } = event.data;
     
     switch (type) {
         case 'INIT':
-            await initialize();
+            await initialize().catch(() => null);
+            break;
+
+        case 'LOAD_FEATURE':
+            // Preloading while the user is still selecting files
+            await loadFeature(data.feature).catch(error => {
+                postMessage({ type: 'ERROR', message: `Failed to load ${data.feature}: ${error.message}` });
+            });
             break;
             
         case 'GENERATE_QR':
             await handleQRGeneration(data);
             break;
             
+        case 'GENERATE_QR_BATCH':
+            await handleQRBatchGeneration(data);
+            break;
+            
         case 'SCAN_START':
             await handleScan(data);
             break;
+
+        case 'DECODE_SHARD':
+            await handleDecodeShard(data);
+            break;
             
         case 'SCAN_CANCEL':
-            // TODO: Implement cancellation
-            postMessage({ type: 'LOG', message: 'Scan cancelled', level: 'warning' });
+            cancelScan();
+            break;
+
+        case 'SCAN_SESSION_RESET':
+            // The files were removed; the next scan must not build on the last one
+            scanSession?.reset();
             break;
             
         default:
@@ -130,9 +148,7 @@ self.onmessage = async function(event) {
 // Handle QR code generation
 async function handleQRGeneration(data) {
     try {
-        if (!isInitialized) {
-            await initialize();
-        }
+        await loadFeature('qr');
         
         const { csvContent, copies, offsetRow, offsetCol, selectedStudents, csvFilename } = data;
         
@@ -186,96 +202,405 @@ async function handleQRGeneration(data) {
     }
 }
 
+// Handle QR code generation for several class lists, returned as one ZIP
+async function handleQRBatchGeneration(data) {
+    try {
+        await loadFeature('qr');
+        
+        const { rosters, copies, offsetRow, offsetCol } = data;
+        
+        postMessage({ type: 'LOG', message: `Generating QR codes for ${rosters.length} class lists...`, level: 'info' });
+        
+        const generateQrBatch = pyodide.globals.get('generate_qr_batch');
+        const pyRosters = pyodide.toPy(rosters);
+        const zipBytesProxy = generateQrBatch.callKwargs(pyRosters, { copies: copies, offset_row: offsetRow, offset_col: offsetCol, as_zip: true });
+        const zipBytes = new Uint8Array(zipBytesProxy.toJs());
+        zipBytesProxy.destroy();
+        pyRosters.destroy();
+        generateQrBatch.destroy();
+        
+        postMessage({
+            type: 'QR_COMPLETE',
+            pdfBytes: zipBytes,
+            filename: 'QR-Codes.zip',
+            mimeType: 'application/zip'
+        }, [zipBytes.buffer]);
+        
+        postMessage({ type: 'LOG', message: 'QR codes generated successfully!', level: 'success' });
+        
+    } catch (error) {
+        postMessage({ 
+            type: 'ERROR', 
+            message: `QR generation error: ${error.message}\n${error.stack}` 
+        });
+    }
+}
+
 // Handle the PDF scanning process
 async function handleScan(data) {
+    // Python objects of this scan; released in the finally block however the scan ends
+    let messageBatch, zipChunkCallback, eventCallback, checkpointCallback, examReader;
     try {
-        if (!isInitialized) {
-            await initialize();
-        }
+        await loadFeature('scan');
         
         const { pdfFiles, options } = data;
         
         postMessage({ type: 'SCAN_LOG', message: 'Starting PDF scan...', level: 'info' });
         
-        // Create progress callback that sends messages back to main thread
+        // Create the callbacks that send results back to main thread. Log messages, progress and
+        // page events are collected in a MessageBatch and sent a few times per second.
         pyodide.runPython(`
 import js
 from pyodide.ffi import to_js
 
-def progress_callback(percentage):
+def batch_callback(batch):
     js.postMessage(to_js({
-        'type': 'SCAN_PROGRESS',
-        'percentage': float(percentage)
+        'type': 'SCAN_BATCH',
+        'logs': batch['logs'],
+        'pages': batch['pages'],
+        'progress': batch['progress']
     }, dict_converter=js.Object.fromEntries))
 
-def log_callback(message, level='info'):
+message_batch = MessageBatch(batch_callback)
+
+def zip_chunk_callback(chunk):
+    # Copy the chunk into a fresh buffer and transfer it, so neither side keeps the archive
+    data = js.Uint8Array.new(len(chunk))
+    data.assign(chunk)
     js.postMessage(to_js({
-        'type': 'SCAN_LOG',
-        'message': str(message),
-        'level': str(level)
-    }, dict_converter=js.Object.fromEntries))
+        'type': 'SCAN_ZIP_CHUNK',
+        'chunk': data
+    }, dict_converter=js.Object.fromEntries), to_js([data.buffer]))
+
+def event_callback(event):
+    # Students are sent as soon as a run of their pages ends, so the page can offer them before
+    # the scan is done; a student whose pages continue later is sent again with all pages
+    if event['type'] == 'student':
+        # Messages logged before this student go out first
+        message_batch.flush()
+        data = js.Uint8Array.new(len(event['pdf']))
+        data.assign(event['pdf'])
+        js.postMessage(to_js({
+            'type': 'SCAN_STUDENT',
+            'name': event['name'],
+            'numPages': event['num_pages'],
+            'fileName': event['file_name'],
+            'pdf': data
+        }, dict_converter=js.Object.fromEntries), to_js([data.buffer]))
+    else:
+        message_batch.add_page({'pageNum': event['page_num'], 'status': event['status'], 'value': event['value']})
+
+def checkpoint_callback(checkpoint):
+    js.storeScanCheckpoint(checkpoint)
         `);
         
-        const progressCallback = pyodide.globals.get('progress_callback');
-        const logCallback = pyodide.globals.get('log_callback');
+        messageBatch = pyodide.globals.get('message_batch');
+        zipChunkCallback = pyodide.globals.get('zip_chunk_callback');
+        eventCallback = pyodide.globals.get('event_callback');
+        checkpointCallback = pyodide.globals.get('checkpoint_callback');
         
         const pdfFilesForPython = pdfFiles.map(file => ({
             name: file.name,
             data: file.data
         }));
         
-        const examReader = ExamReader(pdfFilesForPython, {
+        const scanOptions = {
             two_page_scan: options.twoPageScan || false,
             split_a3: options.splitA3 || false,
-            quick_and_dirty: options.quickAndDirty || false
-        });
+            detect_gutter: options.detectGutter || false,
+            roster: options.rosterCsv || null,
+            quick_and_dirty: options.quickAndDirty || false,
+            summary_mode: options.fullSummary ? 'full' : 'thumbnails',
+            profiling: options.profiling || false
+        };
+        if (!scanSession) {
+            const ScanSession = pyodide.globals.get('ScanSession');
+            scanSession = ScanSession();
+            ScanSession.destroy();
+        }
+        examReader = scanSession.reader(pdfFilesForPython, scanOptions);
         
-        examReader.progress_callback = progressCallback;
-        examReader.log_callback = logCallback;
+        examReader.message_batch = messageBatch;
+        examReader.zip_chunk_callback = zipChunkCallback;
+        examReader.event_callback = eventCallback;
+        examReader.checkpoint_callback = checkpointCallback;
+        currentReader = examReader;
+
+        // Continue an interrupted scan of the same files and options
+        persistCheckpoint = options.persistCache || false;
+        if (!persistCheckpoint) {
+            await cacheDbDelete('scan-checkpoint').catch(() => null);
+        } else if (!scanCheckpoint) {
+            scanCheckpoint = await cacheDbGet('scan-checkpoint').catch(() => null);
+        }
+        if (scanCheckpoint && examReader.resume_from(scanCheckpoint)) {
+            postMessage({ type: 'SCAN_LOG', message: 'Unterbrochener Scan wird fortgesetzt.', level: 'info' });
+        }
+
+        // Pages decoded in earlier scans of this session (or, if enabled, of earlier sessions) are not decoded again
+        if (!decodeCache) {
+            decodeCache = await loadDecodeCache(options.persistCache);
+        }
+        examReader.decode_cache = decodeCache;
+
+        const decodeWorkers = options.decodeWorkers || 1;
+        if (decodeWorkers > 1) {
+            const pagesProxy = examReader.pages_to_decode();
+            const pages = pagesProxy.toJs();
+            pagesProxy.destroy();
+            if (pages.length > 0) {
+                postMessage({ type: 'SCAN_LOG', message: `Decoding pages with ${decodeWorkers} workers...`, level: 'info' });
+                const decodedPages = await decodeInShards(pdfFilesForPython, scanOptions, pages, examReader.page_count(), decodeWorkers);
+                examReader.decoded_pages = pyodide.toPy(decodedPages);
+            }
+        }
         
         postMessage({ type: 'SCAN_LOG', message: 'Processing PDFs...', level: 'info' });
         const success = await examReader.process();
         
         if (success) {
             postMessage({ type: 'SCAN_LOG', message: 'Scan completed, preparing results...', level: 'success' });
+            await storeScanCheckpoint(null);
+            scanSession.update(examReader);
             
-            // Get the ZIP and summary bytes
-            const zipBytesProxy = examReader.get_zip_bytes();
+            // The ZIP has already been streamed as SCAN_ZIP_CHUNK messages, only the summary is left
             const summaryBytesProxy = examReader.get_summary_bytes();
-            
-            // Convert to JavaScript Uint8Array
-            const zipBytes = new Uint8Array(zipBytesProxy.toJs());
             const summaryBytes = new Uint8Array(summaryBytesProxy.toJs());
-            
-            // Clean up proxies
-            zipBytesProxy.destroy();
             summaryBytesProxy.destroy();
             
             // Send results back to main thread (transfer ownership for efficiency)
             postMessage({
                 type: 'SCAN_COMPLETE',
-                zipBytes: zipBytes,
                 summaryBytes: summaryBytes
-            }, [zipBytes.buffer, summaryBytes.buffer]);
+            }, [summaryBytes.buffer]);
             
             postMessage({ type: 'SCAN_LOG', message: 'Results sent to main thread', level: 'success' });
+
+            if (scanOptions.profiling) {
+                const metricsProxy = examReader.get_metrics();
+                const metrics = metricsProxy.toJs({ dict_converter: Object.fromEntries });
+                metricsProxy.destroy();
+                postMessage({ type: 'SCAN_METRICS', metrics: metrics });
+            }
+
+            await storeDecodeCache(options.persistCache);
             
+        } else if (examReader.cancelled) {
+            postMessage({ type: 'SCAN_CANCELLED' });
         } else {
             postMessage({ type: 'ERROR', message: 'PDF scan failed' });
         }
         
+    } catch (error) {
+        if (error instanceof ScanCancelledError) {
+            postMessage({ type: 'SCAN_CANCELLED' });
+        } else {
+            postMessage({ 
+                type: 'ERROR', 
+                message: `Scan error: ${error.message}\n${error.stack}` 
+            });
+        }
+    } finally {
         // Clean up
+        currentReader = null;
+        examReader?.close();
+        messageBatch?.destroy();
+        zipChunkCallback?.destroy();
+        eventCallback?.destroy();
+        checkpointCallback?.destroy();
+    }
+}
+
+class ScanCancelledError extends Error {}
+
+// Stop the running scan: shard workers are terminated right away, the reader stops at the next page
+// after saving a checkpoint.
+function cancelScan() {
+    for (const { worker, reject } of shardWorkers) {
+        worker.terminate();
+        reject(new ScanCancelledError('Scan cancelled'));
+    }
+    shardWorkers = [];
+    if (currentReader) {
+        currentReader.cancel();
+    }
+    postMessage({ type: 'SCAN_LOG', message: 'Scan wird abgebrochen...', level: 'warning' });
+}
+
+// Called from Python with the checkpoint of the running scan, or with null once it has finished.
+// Like the decode cache, it only goes to IndexedDB when the user enabled it.
+async function storeScanCheckpoint(checkpoint) {
+    scanCheckpoint = checkpoint;
+    if (!persistCheckpoint) {
+        return;
+    }
+    try {
+        if (checkpoint) {
+            await cacheDbSet('scan-checkpoint', checkpoint);
+        } else {
+            await cacheDbDelete('scan-checkpoint');
+        }
+    } catch (error) {
+        postMessage({ type: 'LOG', message: `Could not store scan checkpoint: ${error.message}`, level: 'warning' });
+    }
+}
+
+// Decode the pages in parallel: every shard worker runs its own Pyodide instance and decodes
+// a contiguous range of pages. The two-page inference is applied afterwards by the coordinating reader.
+function decodeInShards(pdfFiles, scanOptions, pages, totalPages, numWorkers) {
+    const shardSize = Math.ceil(pages.length / numWorkers);
+    const shards = [];
+    for (let start = 0; start < pages.length; start += shardSize) {
+        shards.push(pages.slice(start, start + shardSize));
+    }
+
+    const donePages = new Array(shards.length).fill(0);
+    return Promise.all(shards.map((pages, index) => new Promise((resolve, reject) => {
+        const shardWorker = new Worker('scan-worker.js');
+        shardWorkers.push({ worker: shardWorker, reject });
+        shardWorker.onmessage = (event) => {
+            const message = event.data;
+            switch (message.type) {
+                case 'SHARD_PROGRESS':
+                    donePages[index] = message.percentage * pages.length;
+                    postMessage({
+                        type: 'SCAN_PROGRESS',
+                        percentage: donePages.reduce((a, b) => a + b, 0) / (totalPages + 1)
+                    });
+                    break;
+
+                case 'SHARD_COMPLETE':
+                    shardWorker.terminate();
+                    resolve(message.results);
+                    break;
+
+                case 'ERROR':
+                    shardWorker.terminate();
+                    reject(new Error(message.message));
+                    break;
+            }
+        };
+        shardWorker.onerror = (error) => {
+            shardWorker.terminate();
+            reject(new Error(error.message));
+        };
+        shardWorker.postMessage({ type: 'DECODE_SHARD', data: { pdfFiles, options: scanOptions, pages } });
+    }))).then(results => results.flat()).finally(() => {
+        // After the first failure Promise.all gives up on the others; they must not keep running
+        for (const { worker } of shardWorkers) {
+            worker.terminate();
+        }
+        shardWorkers = [];
+    });
+}
+
+// Decode a shard of pages on behalf of a coordinating scan worker
+async function handleDecodeShard(data) {
+    try {
+        await loadFeature('decode');
+
+        const { pdfFiles, options, pages } = data;
+
+        pyodide.runPython(`
+import js
+from pyodide.ffi import to_js
+
+def shard_progress_callback(percentage):
+    js.postMessage(to_js({
+        'type': 'SHARD_PROGRESS',
+        'percentage': float(percentage)
+    }, dict_converter=js.Object.fromEntries))
+
+def shard_log_callback(message, level='info'):
+    pass
+        `);
+
+        const progressCallback = pyodide.globals.get('shard_progress_callback');
+        const logCallback = pyodide.globals.get('shard_log_callback');
+
+        const examReader = ExamReader(pdfFiles, options);
+        examReader.progress_callback = progressCallback;
+        examReader.log_callback = logCallback;
+
+        const resultsProxy = await examReader.decode_pages(pyodide.toPy(pages));
+        const results = resultsProxy.toJs({ dict_converter: Object.fromEntries });
+        resultsProxy.destroy();
+
+        postMessage({ type: 'SHARD_COMPLETE', results: results });
+
         examReader.close();
         progressCallback.destroy();
         logCallback.destroy();
-        
+
     } catch (error) {
-        postMessage({ 
-            type: 'ERROR', 
-            message: `Scan error: ${error.message}\n${error.stack}` 
+        postMessage({
+            type: 'ERROR',
+            message: `Shard decode error: ${error.message}\n${error.stack}`
         });
     }
 }
 
+// Decode cache persistence. Decoded pages contain student names, so they are only written to
+// IndexedDB when the user enabled it; otherwise any stored copy is removed.
+const CACHE_DB_NAME = 'dirueLei';
+const CACHE_STORE_NAME = 'scan-cache';
+
+function openCacheDb() {
+    return new Promise((resolve, reject) => {
+        const request = indexedDB.open(CACHE_DB_NAME, 1);
+        request.onupgradeneeded = () => request.result.createObjectStore(CACHE_STORE_NAME);
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+async function cacheDbRequest(mode, operation) {
+    const db = await openCacheDb();
+    try {
+        return await new Promise((resolve, reject) => {
+            const request = operation(db.transaction(CACHE_STORE_NAME, mode).objectStore(CACHE_STORE_NAME));
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    } finally {
+        db.close();
+    }
+}
+
+const cacheDbGet = (key) => cacheDbRequest('readonly', store => store.get(key));
+const cacheDbSet = (key, value) => cacheDbRequest('readwrite', store => store.put(value, key));
+const cacheDbDelete = (key) => cacheDbRequest('readwrite', store => store.delete(key));
+
+async function loadDecodeCache(persist) {
+    const DecodeCache = pyodide.globals.get('DecodeCache');
+    let cache = null;
+    try {
+        const stored = persist ? await cacheDbGet('decode-cache') : null;
+        if (stored) {
+            cache = DecodeCache.from_json(stored);
+            postMessage({ type: 'SCAN_LOG', message: `Loaded ${cache.__len__()} cached page results`, level: 'info' });
+        }
+    } catch (error) {
+        postMessage({ type: 'LOG', message: `Could not load decode cache: ${error.message}`, level: 'warning' });
+    }
+    if (!cache) {
+        cache = DecodeCache();
+    }
+    DecodeCache.destroy();
+    return cache;
+}
+
+async function storeDecodeCache(persist) {
+    try {
+        if (persist) {
+            await cacheDbSet('decode-cache', decodeCache.to_json());
+        } else {
+            await cacheDbDelete('decode-cache');
+        }
+    } catch (error) {
+        postMessage({ type: 'LOG', message: `Could not store decode cache: ${error.message}`, level: 'warning' });
+    }
+}
+
 // Send initial ready message
 postMessage({ type: 'READY' });